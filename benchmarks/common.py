@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Benchmark helpers:
+------------
+
+Set up HDX configuration and a downloader that serves the test fixtures so that benchmarks run offline.
+
+"""
+import logging
+import time
+from contextlib import contextmanager
+from os import environ, remove
+from os.path import exists, join
+
+from hdx.data.vocabulary import Vocabulary
+from hdx.hdx_configuration import Configuration
+from hdx.hdx_locations import Locations
+from hdx.location.country import Country
+from hdx.utilities.path import get_temp_dir
+
+import run
+
+fixtures = join('tests', 'fixtures')
+
+
+class FixtureDownload:
+    """Serves indicator metadata and xlsx files locally. Country page probes succeed after latency seconds."""
+    def __init__(self, files=None, latency=0.0):
+        if files is None:
+            files = {'https://dada': join(fixtures, 'idmc_displacement_all_dataset.xlsx'),
+                     'https://wawa': join(fixtures, 'idmc_disaster_all_dataset.xlsx')}
+        self.files = files
+        self.latency = latency
+
+    @staticmethod
+    def download_tabular_key_value(url):
+        names = {'https://lala': 'Internally displaced persons - IDPs',
+                 'https://haha': 'Internally displaced persons - IDPs (new displacement associated with disasters)'}
+        return {'Indicator Name': names[url], 'Long definition': 'Description',
+                'Statistical concept and methodology': 'Methodology', 'Limitations and exceptions': 'Caveats'}
+
+    def download_file(self, url, folder, filename):
+        return self.files[url]
+
+    def setup(self, url):
+        time.sleep(self.latency)
+        return True
+
+    @staticmethod
+    def get_hashes():
+        return dict()
+
+    @staticmethod
+    def mark_completed(sources=None):
+        pass
+
+
+@contextmanager
+def offline_run(downloader, folder):
+    """Lets run.build and run.publish be called with downloader serving every download, including those made from
+    threads, and with their temporary files kept in folder"""
+    thread_downloaders = run.thread_downloaders
+    temp_dir = environ.get('TEMP_DIR')
+
+    @contextmanager
+    def fixture_downloaders():
+        yield lambda: downloader
+
+    run.thread_downloaders = fixture_downloaders
+    environ['TEMP_DIR'] = join(folder, 'temp')
+    try:
+        yield
+    finally:
+        run.thread_downloaders = thread_downloaders
+        if temp_dir is None:
+            del environ['TEMP_DIR']
+        else:
+            environ['TEMP_DIR'] = temp_dir
+
+
+def forget_published():
+    """Removes the publish manifest so that the next run.publish creates every dataset again"""
+    path = join(get_temp_dir('IDMC-publish'), 'manifest.json')
+    if exists(path):
+        remove(path)
+
+
+def configure(hdx_url=None):
+    """Create an HDX configuration from the test project configuration, writing to hdx_url if given"""
+    kwargs = {'user_agent': 'benchmark', 'project_config_yaml': join('tests', 'config', 'project_configuration.yml')}
+    if hdx_url:
+        kwargs.update({'hdx_url': hdx_url, 'hdx_key': '12345', 'hdx_read_only': False})
+    else:
+        kwargs['hdx_read_only'] = True
+    logging.disable(logging.WARNING)
+    Configuration._create(**kwargs)
+    countries = Country.countriesdata(use_live=False)['countries']
+    Locations.set_validlocations([{'name': x.lower(), 'title': x} for x in sorted(countries)] +
+                                 [{'name': 'world', 'title': 'World'}])
+    Vocabulary._tags_dict = True
+    Vocabulary._approved_vocabulary = {'tags': [{'name': tag} for tag in Configuration.read()['tags']],
+                                       'id': '4e61d464-4943-4e97-973a-84673c1aaa87', 'name': 'approved'}
@@ -0,0 +1,128 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+HDX stub:
+------------
+
+Minimal in memory stand-in for the CKAN action API used by HDX so that publishing can be benchmarked locally.
+
+"""
+import cgi
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class HDXStub:
+    """Serves CKAN actions from dictionaries in memory, sleeping latency seconds before each response"""
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.objects = dict()
+        self.calls = Counter()
+        self.bytes_uploaded = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                action = self.path.rstrip('/').split('/')[-1]
+                data = stub.read_request(self)
+                time.sleep(stub.latency)
+                status, result = stub.call_action(action, data)
+                if status == 200:
+                    body = {'success': True, 'result': result}
+                else:
+                    body = {'success': False, 'error': {'__type': 'Not Found Error', 'message': 'Not found'}}
+                body = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def read_request(self, handler):
+        length = int(handler.headers.get('Content-Length', 0))
+        content_type = handler.headers.get('Content-Type', '')
+        if not content_type.startswith('multipart/form-data'):
+            body = handler.rfile.read(length)
+            return json.loads(body.decode('utf-8')) if body else dict()
+        form = cgi.FieldStorage(fp=handler.rfile, headers=handler.headers,
+                                environ={'REQUEST_METHOD': 'POST', 'CONTENT_TYPE': content_type})
+        data = dict()
+        for key in form.keys():
+            field = form[key]
+            if field.filename:
+                with self.lock:
+                    self.bytes_uploaded += len(field.value)
+                data['url'] = field.filename
+            else:
+                data[key] = field.value
+        return data
+
+    def get(self, objtype, identifier):
+        objects = self.objects.get(objtype, dict())
+        obj = objects.get(identifier)
+        if obj is None:
+            for candidate in objects.values():
+                if candidate.get('name') == identifier:
+                    return candidate
+        return obj
+
+    def save(self, objtype, data):
+        existing = self.get(objtype, data.get('id') or data.get('name'))
+        if existing:
+            existing.update(data)
+            obj = existing
+        else:
+            obj = dict(data)
+            obj['id'] = str(uuid.uuid4())
+        self.objects.setdefault(objtype, dict())[obj['id']] = obj
+        return obj
+
+    def call_action(self, action, data):
+        with self.lock:
+            self.calls[action] += 1
+            objtype, _, verb = action.rpartition('_')
+            if verb == 'show':
+                obj = self.get(objtype, data.get('id'))
+                if obj is None:
+                    return 404, None
+                return 200, obj
+            if verb in ('create', 'update', 'patch'):
+                obj = self.save(objtype, data)
+                if objtype == 'package':
+                    resources = list()
+                    for resource in obj.get('resources', list()):
+                        resource['package_id'] = obj['id']
+                        resources.append(self.save('resource', resource))
+                    obj['resources'] = resources
+                return 200, obj
+            if verb == 'list':
+                return 200, list()
+            return 200, dict()
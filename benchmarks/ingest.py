@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Ingest benchmark:
+------------
+
+Measures how fast synthetic IDMC exports are parsed on their own and compares ingesting them into the column store
+with different numbers of worker processes. Scales are multiples of the row count of the test fixtures.
+
+    python -m benchmarks.ingest --scales 10 100 1000 --workers 1 2
+
+"""
+import argparse
+import math
+import time
+
+from hdx.hdx_configuration import Configuration
+from hdx.utilities.path import temp_dir
+
+from benchmarks.common import FixtureDownload, configure
+from benchmarks.synthetic import write_exports
+from hxlreader import read_hxl
+from idmc import generate_indicator_datasets_and_showcase
+
+fixture_rows = 6
+
+
+def parse(paths):
+    rows = 0
+    for path in paths:
+        _, _, data = read_hxl(path)
+        for _ in data:
+            rows += 1
+    return rows
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingest throughput benchmark')
+    parser.add_argument('--scales', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2], help='Processes parsing the exports')
+    args = parser.parse_args()
+
+    configure()
+    indicators = Configuration.read()['indicators']
+    tags = Configuration.read()['tags']
+    print('%8s %8s %10s %12s %12s %12s' % ('scale', 'rows', 'workers', 'parse rows/s', 'ingest s', 'speedup'))
+    for scale in args.scales:
+        rows = fixture_rows * scale
+        countries = min(200, max(3, scale))
+        rows_per_year = max(1, int(math.ceil(rows / (countries * args.years))))
+        with temp_dir('idmc-benchmark-ingest') as folder:
+            files = write_exports(folder, countries, args.years, rows_per_year)
+            downloader = FixtureDownload(files)
+            parsed, parse_time = timed(parse, files.values())
+            baseline = None
+            for workers in args.workers:
+                _, ingest_time = timed(generate_indicator_datasets_and_showcase, downloader, folder, indicators, tags,
+                                       workers)
+                if baseline is None:
+                    baseline = ingest_time
+                print('%8d %8d %10d %12.0f %12.2f %11.1fx' % (scale, parsed, workers, parsed / parse_time,
+                                                              ingest_time, baseline / ingest_time))
+
+
+if __name__ == '__main__':
+    main()
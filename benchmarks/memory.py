@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Memory benchmark:
+------------
+
+Compares memory used by ingesting synthetic IDMC exports into the column store with keeping hxl Row objects per
+country plus a list of all rows as was done previously. Scales are multiples of the row count of the test fixtures.
+
+    python -m benchmarks.memory --scales 10 100 1000
+
+"""
+import argparse
+import gc
+import math
+import tracemalloc
+
+import hxl
+from hdx.hdx_configuration import Configuration
+from hdx.utilities.dictandlist import dict_of_lists_add
+from hdx.utilities.path import temp_dir
+
+from benchmarks.common import FixtureDownload, configure
+from benchmarks.synthetic import write_exports
+from idmc import generate_indicator_datasets_and_showcase
+
+fixture_rows = 6
+
+
+def legacy_ingest(downloader, folder, indicators, tags):
+    countriesdata = dict()
+    allrows = dict()
+    for indicator in indicators:
+        data = hxl.data(downloader.download_file(indicator['url'], folder, None), allow_local=True)
+        hxltags = data.display_tags
+        rows = [data.headers, hxltags]
+        for row in data:
+            rows.append([row.get(hxltag) for hxltag in hxltags])
+            iso3 = row.get('#country+code')
+            epcountrydata = countriesdata.get(iso3, dict())
+            dict_of_lists_add(epcountrydata, indicator['name'], row)
+            countriesdata[iso3] = epcountrydata
+        allrows[indicator['name']] = rows
+    return countriesdata, allrows
+
+
+def measure(function, *args):
+    gc.collect()
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    result = function(*args)
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return retained - start, peak - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingest memory benchmark')
+    parser.add_argument('--scales', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--years', type=int, default=10)
+    args = parser.parse_args()
+
+    configure()
+    indicators = Configuration.read()['indicators']
+    tags = Configuration.read()['tags']
+    print('%8s %8s %16s %14s %16s %14s' % ('scale', 'rows', 'legacy retained', 'legacy peak', 'columns retained',
+                                            'columns peak'))
+    for scale in args.scales:
+        rows = fixture_rows * scale
+        countries = min(200, max(3, scale))
+        rows_per_year = max(1, int(math.ceil(rows / (countries * args.years))))
+        with temp_dir('idmc-benchmark-memory') as folder:
+            downloader = FixtureDownload(write_exports(folder, countries, args.years, rows_per_year))
+            legacy = measure(legacy_ingest, downloader, folder, indicators, tags)
+            columns = measure(generate_indicator_datasets_and_showcase, downloader, folder, indicators, tags)
+        print('%8d %8d %14.1fMB %12.1fMB %14.1fMB %12.1fMB' % (scale, countries * args.years * rows_per_year,
+                                                              legacy[0] / 1e6, legacy[1] / 1e6,
+                                                              columns[0] / 1e6, columns[1] / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite:
+------------
+
+Times and measures the peak memory of each stage of a run on synthetic IDMC exports of a given size: parsing the
+exports, partitioning their rows by country, the full ingest of the indicator datasets (downloading, parsing,
+partitioning and writing), writing the indicator csvs alone, resolving showcase urls, generating the country csvs and
+publishing a staged build to a local HDX stub with run.publish. Results can be saved as JSON and compared with
+those saved from another version.
+
+    python -m benchmarks.suite --countries 200 --years 10 --rows-per-year 5 --save before.json
+    python -m benchmarks.suite --countries 200 --years 10 --rows-per-year 5 --compare before.json
+
+"""
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+from os.path import join
+
+from hdx.data.dataset import Dataset
+from hdx.hdx_configuration import Configuration
+from hdx.utilities.path import temp_dir
+
+from benchmarks.common import FixtureDownload, configure, forget_published, offline_run
+from benchmarks.hdxstub import HDXStub
+from benchmarks.synthetic import write_exports
+from hxlreader import read_hxl
+from idmc import CountryIndex, generate_country_dataset_and_showcase, generate_indicator_datasets_and_showcase, \
+    get_country_template, partition_rows
+from run import build, publish
+from showcaseurls import ShowcaseURLs
+from writers import write_resource
+
+
+@contextmanager
+def stage(results, name, items, trace):
+    """Records the seconds taken by the stage, keeping the fastest of repeated runs, or, if trace is True, the peak
+    memory allocated during it"""
+    gc.collect()
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    result = results.setdefault(name, {'items': items})
+    if trace:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result['peak_mb'] = round(peak / 1e6, 2)
+    else:
+        result['seconds'] = round(min(elapsed, result.get('seconds', elapsed)), 4)
+
+
+def run_stages(results, args, exports, trace):
+    downloader = FixtureDownload(exports, latency=args.latency)
+    indicators = Configuration.read()['indicators']
+    tags = Configuration.read()['tags']
+    rows = args.countries * args.years * args.rows_per_year * len(indicators)
+    with temp_dir('idmc-benchmark-suite') as folder:
+        with stage(results, 'ingest', rows, trace):
+            parsed = list()
+            for indicator in indicators:
+                headers, hxltags, data = read_hxl(downloader.download_file(indicator['url'], folder, None))
+                parsed.append((indicator['name'], headers, hxltags, list(data)))
+        with stage(results, 'partition', rows, trace):
+            countryindex = CountryIndex()
+            for name, headers, hxltags, data in parsed:
+                partition_rows(name, headers, hxltags, data, countryindex)
+        del parsed
+        with stage(results, 'full ingest', rows, trace):
+            datasets, _, headersdata, countriesdata, countryindex = \
+                generate_indicator_datasets_and_showcase(downloader, folder, indicators, tags,
+                                                         args.ingest_workers)
+        countries = sorted(x for x in countriesdata if x)
+        indicatorsdata = {name: next(countriesdata[countryiso][name] for countryiso in countries
+                                     if name in countriesdata[countryiso]) for name in headersdata}
+        with stage(results, 'indicator csvs', rows, trace):
+            for name, (headers, hxltags) in headersdata.items():
+                write_resource(Dataset(), 'csv', folder, name, headers, hxltags, indicatorsdata[name],
+                               {'name': name, 'description': name})
+        template = get_country_template(datasets, tags)
+        with stage(results, 'showcase urls', len(countries), trace):
+            showcase_urls = ShowcaseURLs(join(folder, 'showcase_urls.json'))
+            showcase_urls = showcase_urls.resolve(countries, lambda: downloader, workers=args.showcase_workers)
+        with stage(results, 'country csvs', len(countries), trace):
+            for countryiso in countries:
+                generate_country_dataset_and_showcase(downloader, folder, headersdata, countryiso,
+                                                      countriesdata[countryiso], countryindex, template,
+                                                      showcase_urls)
+        staging = join(folder, 'staging')
+        with offline_run(downloader, folder):
+            build(downloader, staging, indicators, tags, {'ingest_workers': args.ingest_workers,
+                                                          'showcase_workers': args.showcase_workers})
+            forget_published()
+            with stage(results, 'publish', len(countries), trace):
+                publish(downloader, staging, args.workers)
+
+
+def get_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results, baseline, threshold):
+    """Prints the change of each measure from baseline returning the number that grew by more than threshold"""
+    print('\nCompared with %s:' % baseline['version'])
+    print('%16s %10s %12s %12s %9s' % ('stage', 'measure', 'baseline', 'current', 'change'))
+    regressions = 0
+    for name, result in results['stages'].items():
+        previous = baseline['stages'].get(name)
+        if previous is None:
+            continue
+        for measure in ('seconds', 'peak_mb'):
+            if measure not in result or not previous.get(measure):
+                continue
+            change = result[measure] / previous[measure] - 1
+            flag = ''
+            if change > threshold:
+                flag = ' REGRESSION'
+                regressions += 1
+            print('%16s %10s %12.3f %12.3f %+8.1f%%%s' % (name, measure, previous[measure], result[measure],
+                                                         change * 100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per stage benchmark suite on synthetic IDMC exports')
+    parser.add_argument('--countries', type=int, default=100)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--rows-per-year', type=int, default=5, help='Rows per country and year of each indicator')
+    parser.add_argument('--format', default='xlsx', choices=['xlsx', 'csv'], help='Format of the synthetic exports')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds each HDX request or page probe waits')
+    parser.add_argument('--ingest-workers', type=int, default=1, help='Processes parsing the indicator exports')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--showcase-workers', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=1, help='Times to run each stage keeping the fastest')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the second pass that traces memory')
+    parser.add_argument('--save', help='Save results as JSON to this path')
+    parser.add_argument('--compare', help='Compare with results saved by an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Fractional growth reported as a regression')
+    args = parser.parse_args()
+
+    stages = OrderedDict()
+    with HDXStub(latency=args.latency) as stub, temp_dir('idmc-benchmark-exports') as folder:
+        configure(stub.url)
+        exports = write_exports(folder, args.countries, args.years, args.rows_per_year, file_format=args.format)
+        for _ in range(args.repeat):
+            run_stages(stages, args, exports, trace=False)
+        if not args.no_memory:
+            run_stages(stages, args, exports, trace=True)
+    parameters = {key: getattr(args, key) for key in ('countries', 'years', 'rows_per_year', 'format', 'latency',
+                                                       'ingest_workers', 'workers', 'showcase_workers')}
+    results = {'version': get_version(), 'python': platform.python_version(),
+               'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'parameters': parameters, 'stages': stages}
+
+    print('%16s %10s %10s %12s %10s' % ('stage', 'items', 'seconds', 'items/s', 'peak MB'))
+    for name, result in stages.items():
+        seconds = result['seconds']
+        print('%16s %10d %10.3f %12.0f %10s' % (name, result['items'], seconds, result['items'] / seconds,
+                                                result.get('peak_mb', '-')))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['parameters'] != parameters:
+            print('\nWarning: baseline was run with %s' % baseline['parameters'])
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
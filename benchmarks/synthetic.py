@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Synthetic IDMC exports:
+------------
+
+Generates xlsx or csv files with the same headers and HXL hashtags as the IDMC displacement and disaster exports.
+
+"""
+import csv
+import random
+from os.path import join
+
+from hdx.location.country import Country
+from openpyxl import Workbook
+
+indicators = {
+    'displacement_data': (['ISO3', 'Name', 'Year', 'Conflict Stock Displacement', 'Conflict New Displacements',
+                           'Disaster New Displacements'],
+                          ['#country+code', '#country+name', '#date+year', '#affected+idps+ind+stock+conflict',
+                           '#affected+idps+ind+newdisp+conflict', '#affected+idps+ind+newdisp+disaster']),
+    'disaster_data': (['ISO3', 'Name', 'Year', 'Start Date', 'Event Name', 'Hazard Category', 'Hazard Type',
+                       'New Displacements'],
+                      ['#country+code', '#country+name', '#date+year', '#date+start', '#description',
+                       '#crisis+category', '#crisis+type', '#affected+idps+ind+newdisp+disaster'])
+}
+hazards = [('Weather related', 'Flood'), ('Weather related', 'Storm'), ('Weather related', 'Drought'),
+           ('Geophysical', 'Earthquake'), ('Geophysical', 'Volcanic eruption')]
+
+
+def get_countries(number):
+    """Returns number (iso3, name) tuples cycling through the countries known to hdx-python-country"""
+    countries = Country.countriesdata(use_live=False)['countries']
+    isos = sorted(countries)
+    result = list()
+    for i in range(number):
+        iso3 = isos[i % len(isos)]
+        result.append((iso3, countries[iso3]['#country+name+preferred']))
+    return result
+
+
+def generate_rows(indicator, countries, years, rows_per_year, seed=0):
+    """Yields rows of values for an indicator for each country, year and row within the year"""
+    rng = random.Random(seed)
+    for iso3, name in countries:
+        for year in range(2019 - years, 2019):
+            for i in range(rows_per_year):
+                if indicator == 'displacement_data':
+                    values = [rng.choice((None, rng.randint(1, 1000000))) for _ in range(3)]
+                    yield [iso3, name, year] + values
+                else:
+                    category, hazard = rng.choice(hazards)
+                    start = '%d-%02d-%02d' % (year, rng.randint(1, 12), rng.randint(1, 28))
+                    event = '%s: %s - %s' % (name, hazard, start)
+                    yield [iso3, name, year, start, event, category, hazard, rng.randint(1, 100000)]
+
+
+def write_xlsx(folder, indicator, countries, years, rows_per_year, seed=0):
+    """Writes a synthetic export for an indicator to folder returning its path"""
+    headers, hxltags = indicators[indicator]
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(headers)
+    sheet.append(hxltags)
+    for row in generate_rows(indicator, countries, years, rows_per_year, seed):
+        sheet.append(row)
+    path = join(folder, 'synthetic_%s.xlsx' % indicator)
+    workbook.save(path)
+    return path
+
+
+def write_csv(folder, indicator, countries, years, rows_per_year, seed=0):
+    """Writes a synthetic export for an indicator to folder as csv returning its path"""
+    headers, hxltags = indicators[indicator]
+    path = join(folder, 'synthetic_%s.csv' % indicator)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        writer.writerow(hxltags)
+        writer.writerows(generate_rows(indicator, countries, years, rows_per_year, seed))
+    return path
+
+
+def write_exports(folder, countries, years, rows_per_year, seed=0, file_format='xlsx'):
+    """Writes synthetic exports for all indicators returning a dictionary of url to path for FixtureDownload"""
+    countries = get_countries(countries)
+    write = write_csv if file_format == 'csv' else write_xlsx
+    return {'https://dada': write(folder, 'displacement_data', countries, years, rows_per_year, seed),
+            'https://wawa': write(folder, 'disaster_data', countries, years, rows_per_year, seed)}
@@ -0,0 +1,69 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Worker benchmark:
+------------
+
+Times publishing a staged build of synthetic countries to a local HDX stub with run.publish for different numbers of
+workers and then publishing it again using the publish manifest, once when the datasets are new and once when they are
+unchanged.
+
+    python -m benchmarks.workers --countries 60 --latency 0.02 --workers 1 2 4 8
+
+"""
+import argparse
+import time
+from os.path import join
+
+from hdx.hdx_configuration import Configuration
+from hdx.utilities.path import temp_dir
+
+from benchmarks.common import FixtureDownload, configure, forget_published, offline_run
+from benchmarks.hdxstub import HDXStub
+from benchmarks.synthetic import write_exports
+from run import build, publish
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Country dataset publishing benchmark')
+    parser.add_argument('--countries', type=int, default=60, help='Number of country datasets to publish')
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--rows-per-year', type=int, default=1, help='Rows per country and year of each indicator')
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds the HDX stub waits per request')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    with HDXStub(latency=args.latency) as stub, temp_dir('idmc-benchmark') as folder:
+        configure(stub.url)
+        config = Configuration.read()
+        downloader = FixtureDownload(write_exports(folder, args.countries, args.years, args.rows_per_year),
+                                     latency=args.latency)
+        staging = join(folder, 'staging')
+        with offline_run(downloader, folder):
+            staged = build(downloader, staging, config['indicators'], config['tags'], dict(config, build_workers=1))
+            datasets = len(staged['indicators']) + len(staged['countries'])
+            print('%8s %10s %12s %10s' % ('workers', 'seconds', 'datasets/s', 'speedup'))
+            baseline = None
+            for workers in args.workers:
+                forget_published()
+                start = time.perf_counter()
+                publish(downloader, staging, workers)
+                elapsed = time.perf_counter() - start
+                if baseline is None:
+                    baseline = elapsed
+                print('%8d %10.2f %12.1f %9.1fx' % (workers, elapsed, datasets / elapsed, baseline / elapsed))
+
+            forget_published()
+            print('\n%12s %10s %14s %14s' % ('manifest', 'seconds', 'HDX requests', 'bytes uploaded'))
+            for run in ('new', 'unchanged'):
+                calls = sum(stub.calls.values())
+                uploaded = stub.bytes_uploaded
+                start = time.perf_counter()
+                publish(downloader, staging, 1)
+                elapsed = time.perf_counter() - start
+                print('%12s %10.2f %14d %14d' % (run, elapsed, sum(stub.calls.values()) - calls,
+                                                 stub.bytes_uploaded - uploaded))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Writer benchmark:
+------------
+
+Compares the resource writers on synthetic IDMC exports: the time taken and bytes written to write the resource of
+each indicator and of each country, and the bytes uploaded when a build staged with the writer is published to a
+local HDX stub with run.publish, which is the whole database. Parquet is skipped unless pyarrow is installed.
+
+    python -m benchmarks.writers --countries 100 --rows-per-year 5
+
+"""
+import argparse
+import time
+from os.path import getsize, join
+
+from hdx.data.dataset import Dataset
+from hdx.hdx_configuration import Configuration
+from hdx.utilities.path import temp_dir
+
+from benchmarks.common import FixtureDownload, configure, forget_published, offline_run
+from benchmarks.hdxstub import HDXStub
+from benchmarks.synthetic import write_exports
+from idmc import generate_indicator_datasets_and_showcase
+from run import build, publish
+from writers import write_resource, writers
+
+
+def get_writers():
+    names = ['csv'] + sorted(writers)
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        names.remove('parquet')
+    return names
+
+
+def write_all(writer, folder, headersdata, countriesdata):
+    """Writes the resource of each indicator and of each country of each indicator returning the bytes written"""
+    nbytes = 0
+    for name, (headers, hxltags) in headersdata.items():
+        countries = sorted((countryiso for countryiso, countrydata in countriesdata.items()
+                            if countryiso and name in countrydata))
+        indicatordata = countriesdata[countries[0]][name]
+        resourcedata = {'name': name, 'description': name}
+        resources = [write_resource(Dataset(), writer, folder, name, headers, hxltags, indicatordata, resourcedata)]
+        for countryiso in countries:
+            resources.append(write_resource(Dataset(), writer, folder, '%s_%s' % (name, countryiso), headers,
+                                            hxltags, indicatordata, resourcedata, countryiso))
+        nbytes += sum(getsize(resource.get_file_to_upload()) for resource in resources)
+    return nbytes
+
+
+def build_and_publish(downloader, folder, indicators, tags, writer, workers):
+    """Stages a build whose indicator and country resources are written with writer and creates all its datasets in
+    HDX"""
+    indicators = [dict(indicator, writer=writer, country_writer=writer) for indicator in indicators]
+    staging = join(folder, 'staging')
+    build(downloader, staging, indicators, tags, {'build_workers': 1})
+    forget_published()
+    publish(downloader, staging, workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Resource writer benchmark')
+    parser.add_argument('--countries', type=int, default=100)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--rows-per-year', type=int, default=5, help='Rows per country and year of each indicator')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    with HDXStub() as stub, temp_dir('idmc-benchmark-writers') as folder:
+        configure(stub.url)
+        indicators = Configuration.read()['indicators']
+        tags = Configuration.read()['tags']
+        downloader = FixtureDownload(write_exports(folder, args.countries, args.years, args.rows_per_year))
+        _, _, headersdata, countriesdata, _ = generate_indicator_datasets_and_showcase(downloader, folder, indicators,
+                                                                                       tags)
+        print('%10s %10s %14s %10s %16s %10s' % ('writer', 'write s', 'bytes written', 'ratio', 'bytes uploaded',
+                                                 'ratio'))
+        baseline = None
+        for writer in get_writers():
+            start = time.perf_counter()
+            written = write_all(writer, folder, headersdata, countriesdata)
+            elapsed = time.perf_counter() - start
+            uploaded = stub.bytes_uploaded
+            with offline_run(downloader, folder):
+                build_and_publish(downloader, folder, indicators, tags, writer, args.workers)
+            uploaded = stub.bytes_uploaded - uploaded
+            if baseline is None:
+                baseline = written, uploaded
+            print('%10s %10.3f %14d %9.2fx %16d %9.2fx' % (writer, elapsed, written, written / baseline[0], uploaded,
+                                                           uploaded / baseline[1]))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Download cache:
+------------
+
+Keeps downloads on disk between runs so that an unchanged source costs one conditional request.
+
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from os import makedirs, remove, replace
+from os.path import join, exists, getsize
+from shutil import copyfile
+
+from hdx.utilities.downloader import DownloadError
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadCache:
+    """Persistent cache of downloads keyed by url wrapping a Download object. Cached content is revalidated with the
+    ETag and Last-Modified headers of the response that fetched it and each url is requested at most once per run.
+    Entries unused for max_age_days are evicted as are the least recently used ones while the cache is over
+    max_size_mb. The content hashes seen when a run last completed are kept so that a run can tell whether any source
+    has changed since then.
+    """
+    def __init__(self, downloader, folder, max_age_days=30, max_size_mb=1000):
+        self.downloader = downloader
+        self.folder = folder
+        self.max_age = max_age_days * 86400
+        self.max_size = max_size_mb * 1000000
+        makedirs(folder, exist_ok=True)
+        self.index_path = join(folder, 'index.json')
+        if exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+        else:
+            index = dict()
+        self.entries = index.get('entries', dict())
+        self.completed = index.get('completed', dict())
+        self.fetched = dict()
+        self.lock = threading.RLock()
+
+    def start_run(self):
+        """Forgets which urls were fetched so that a long running process revalidates them on its next run"""
+        self.fetched = dict()
+
+    def get_path(self, url):
+        return join(self.folder, hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    def fetch(self, url):
+        """Returns the path of up to date content for url, downloading it only if it has changed. Different urls can be
+        fetched from several threads."""
+        with self.lock:
+            path = self.fetched.get(url)
+            if path:
+                return path
+            entry = self.entries.get(url)
+        path = self.get_path(url)
+        headers = dict()
+        if entry and exists(path):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            response = self.downloader.session.get(self.downloader.get_full_url(url), headers=headers, stream=True)
+            if response.status_code == 304:
+                logger.info('%s not modified. Using cached copy.' % url)
+                response.close()
+            else:
+                response.raise_for_status()
+                sha256 = hashlib.sha256()
+                temppath = '%s.part' % path
+                with open(temppath, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=10240):
+                        sha256.update(chunk)
+                        f.write(chunk)
+                replace(temppath, path)
+                entry = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified'),
+                         'hash': sha256.hexdigest()}
+        except Exception as e:
+            raise DownloadError('Download of %s failed! %s' % (url, e)) from e
+        with self.lock:
+            entry['last_used'] = time.time()
+            self.entries[url] = entry
+            self.fetched[url] = path
+            self.save()
+        return path
+
+    def download_file(self, url, folder, filename):
+        path = join(folder, filename)
+        copyfile(self.fetch(url), path)
+        return path
+
+    def download_tabular_key_value(self, url, **kwargs):
+        """Parses the cached content of url with the wrapped Download object so, unlike fetch, it must not be called
+        from several threads at once"""
+        kwargs.setdefault('file_type', 'csv')
+        return self.downloader.download_tabular_key_value(self.fetch(url), **kwargs)
+
+    def has_changed(self, urls):
+        """Fetches urls returning True if the content of any differs from when mark_completed was last called"""
+        changed = False
+        for url in urls:
+            self.fetch(url)
+            if self.entries[url]['hash'] != self.completed.get(url):
+                changed = True
+        return changed
+
+    def get_hashes(self):
+        """Returns the content hashes of the urls fetched in this run"""
+        return {url: self.entries[url]['hash'] for url in self.fetched}
+
+    def mark_completed(self, hashes=None):
+        """Records the content hashes of the urls fetched in this run, or hashes if given, as those of the last
+        completed run"""
+        with self.lock:
+            if hashes is None:
+                hashes = self.get_hashes()
+            self.completed.update(hashes)
+            self.save()
+
+    def evict(self):
+        now = time.time()
+        total = 0
+        keep = list()
+        for url, entry in sorted(self.entries.items(), key=lambda x: x[1]['last_used'], reverse=True):
+            path = self.get_path(url)
+            if not exists(path):
+                continue
+            size = getsize(path)
+            if url not in self.fetched and (now - entry['last_used'] > self.max_age or total + size > self.max_size):
+                logger.info('Evicting %s from download cache' % url)
+                remove(path)
+                continue
+            total += size
+            keep.append(url)
+        self.entries = {url: self.entries[url] for url in keep}
+        self.completed = {url: contenthash for url, contenthash in self.completed.items() if url in self.entries}
+
+    def save(self):
+        self.evict()
+        temppath = '%s.part' % self.index_path
+        with open(temppath, 'w') as f:
+            json.dump({'entries': self.entries, 'completed': self.completed}, f, indent=1, sort_keys=True)
+        replace(temppath, self.index_path)
@@ -0,0 +1,39 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+HXL reader:
+------------
+
+Reads HXLated xlsx files with libhxl resolving the HXL hashtags to columns once.
+
+"""
+import hxl
+
+
+def get_first_value(row, indices):
+    """Like hxl's Row.get, returns the first non empty value in the given columns or None"""
+    length = len(row)
+    for i in indices:
+        if i < length:
+            value = row[i]
+            if value:
+                return value
+    return None
+
+
+def compile_projection(columns, hxltags):
+    """Returns for each HXL hashtag the indices of the columns in which hxl's Row.get would look for its value"""
+    projection = list()
+    for hxltag in hxltags:
+        pattern = hxl.model.TagPattern.parse(hxltag)
+        projection.append(tuple(i for i, column in enumerate(columns) if pattern.match(column)))
+    return projection
+
+
+def read_hxl(path):
+    """Returns the headers, display tags and an iterator of rows of values for each display tag of an xlsx file"""
+    data = hxl.data(path, allow_local=True)
+    hxltags = data.display_tags
+    projection = compile_projection(data.columns, hxltags)
+    return data.headers, hxltags, (tuple(get_first_value(row.values, indices) for indices in projection)
+                                   for row in data)
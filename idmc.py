@@ -7,78 +7,286 @@ IDMC:
 Reads IDMC HXLated csvs and creates datasets.
 
 """
+import json
 import logging
+import sys
+import time
+from array import array
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from copy import deepcopy
+from functools import lru_cache
+from os import replace
+from os.path import getsize
+from types import MappingProxyType
 
 import hxl
 from hdx.data.dataset import Dataset
 from hdx.data.hdxobject import HDXError
 from hdx.data.showcase import Showcase
 from hdx.location.country import Country
-from hdx.utilities.dictandlist import extract_list_from_list_of_dict, dict_of_lists_add
+from hdx.utilities.dictandlist import extract_list_from_list_of_dict
 from hdx.utilities.downloader import DownloadError
 from hdx.utilities.text import get_matching_then_nonmatching_text
 from slugify import slugify
 
+from hxlreader import compile_projection, get_first_value, read_hxl
+from instrumentation import report
+from writers import write_resource
+
 logger = logging.getLogger(__name__)
 
 
+year_tag = '#date+year'
+bite_tags = ('#affected+idps+ind+stock+conflict', '#affected+idps+ind+newdisp+conflict',
+             '#affected+idps+ind+newdisp+disaster')
+
+
+class IndicatorData:
+    """Values of one indicator held column by column along with the row numbers of each country so that a country's
+    rows can be sliced out without keeping hxl Row objects. Repeated strings like names and codes are interned. The
+    columns matching the country, year and bite tags are compiled once from the hashtags."""
+    __slots__ = ('headers', 'hxltags', 'columns', 'countryrows', 'projection')
+
+    def __init__(self, headers, hxltags):
+        self.headers = headers
+        self.hxltags = hxltags
+        self.columns = [list() for _ in hxltags]
+        self.countryrows = dict()
+        self.projection = dict()
+        for tag in ('#country+code', year_tag) + bite_tags:
+            self.get_tag_indices(tag)
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def add_row(self, countryiso, values):
+        rowno = len(self)
+        for column, value in zip(self.columns, values):
+            if isinstance(value, str):
+                value = sys.intern(value)
+            column.append(value)
+        rownos = self.countryrows.get(countryiso)
+        if rownos is None:
+            rownos = array('L')
+            self.countryrows[countryiso] = rownos
+        rownos.append(rowno)
+
+    def get_rownos(self, countryiso=None):
+        if countryiso is None:
+            return range(len(self))
+        return self.countryrows.get(countryiso, ())
+
+    def get_rows(self, countryiso=None):
+        columns = self.columns
+        for rowno in self.get_rownos(countryiso):
+            yield [column[rowno] for column in columns]
+
+    def get_tag_indices(self, tag):
+        indices = self.projection.get(tag)
+        if indices is None:
+            columns = [hxl.model.Column.parse(hxltag) for hxltag in self.hxltags]
+            indices = compile_projection(columns, [tag])[0]
+            self.projection[tag] = indices
+        return indices
+
+    def get_values(self, tag, countryiso=None):
+        """Returns what hxl's Row.get would give for tag in each row of the country or of all rows"""
+        rownos = self.get_rownos(countryiso)
+        indices = self.get_tag_indices(tag)
+        if not indices:
+            return [None] * len(rownos)
+        values = [self.columns[indices[0]][rowno] or None for rowno in rownos]
+        for index in indices[1:]:
+            column = self.columns[index]
+            values = [value or column[rowno] or None for value, rowno in zip(values, rownos)]
+        return values
+
+    def get_year_range(self, countryiso=None):
+        """Returns the earliest and latest years of the country or of all rows"""
+        years = [year for year in self.get_values(year_tag, countryiso) if year is not None]
+        return min(years), max(years)
+
+
+class CountryIndex:
+    """Summary of each country built while its rows are ingested: the earliest and latest year, the number of rows of
+    each indicator and whether any row has a value for each of the bite tags. It is kept as plain dictionaries so that
+    it can be saved to and loaded from JSON."""
+    def __init__(self, countries=None):
+        if countries is None:
+            countries = dict()
+        self.countries = countries
+
+    def add_row(self, countryiso, indicator, year, bites):
+        summary = self.countries.get(countryiso)
+        if summary is None:
+            summary = {'startyear': None, 'endyear': None, 'rows': dict(), 'bites': [False] * len(bite_tags)}
+            self.countries[countryiso] = summary
+        if year is not None:
+            if summary['startyear'] is None or year < summary['startyear']:
+                summary['startyear'] = year
+            if summary['endyear'] is None or year > summary['endyear']:
+                summary['endyear'] = year
+        rows = summary['rows']
+        rows[indicator] = rows.get(indicator, 0) + 1
+        populated = summary['bites']
+        for i, value in enumerate(bites):
+            if value is not None:
+                populated[i] = True
+
+    def merge(self, countries):
+        """Adds the summaries of countries built from the rows of other indicators, eg. in a worker process. Merging
+        the indicators in order gives the same index as adding their rows in order."""
+        for countryiso, other in countries.items():
+            summary = self.countries.get(countryiso)
+            if summary is None:
+                self.countries[countryiso] = other
+                continue
+            for key, better in (('startyear', min), ('endyear', max)):
+                years = [year for year in (summary[key], other[key]) if year is not None]
+                summary[key] = better(years) if years else None
+            summary['rows'].update(other['rows'])
+            summary['bites'] = [populated or other_populated
+                                for populated, other_populated in zip(summary['bites'], other['bites'])]
+
+    def get_year_range(self, countryiso):
+        summary = self.countries[countryiso]
+        return summary['startyear'], summary['endyear']
+
+    def get_row_counts(self, countryiso):
+        return self.countries[countryiso]['rows']
+
+    def get_bites_disabled(self, countryiso):
+        return [not populated for populated in self.countries[countryiso]['bites']]
+
+    def save(self, path):
+        temppath = '%s.part' % path
+        with open(temppath, 'w') as f:
+            json.dump(self.countries, f, indent=1, sort_keys=True)
+        replace(temppath, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+
 def get_dataset(title, tags, name):
     logger.info('Creating dataset: %s' % title)
     dataset = Dataset({
         'name': slugify(name).lower(),
         'title': title
     })
+    add_common_metadata(dataset, tags)
+    return dataset
+
+
+def add_common_metadata(dataset, tags):
     dataset.set_maintainer('196196be-6037-4488-8b71-d786adf4c081')
     dataset.set_organization('647d9d8c-4cac-4c33-b639-649aad1c2893')
     dataset.set_expected_update_frequency('Every year')
     dataset.set_subnational(False)
     dataset.add_tags(tags)
-    return dataset
 
 
-def generate_indicator_datasets_and_showcase(downloader, folder, indicators, tags):
+def partition_rows(name, headers, hxltags, rows, countryindex):
+    """Buckets the rows of an indicator by country into an IndicatorData adding each row to countryindex"""
+    indicatordata = IndicatorData(headers, hxltags)
+    iso3_indices = indicatordata.get_tag_indices('#country+code')
+    year_indices = indicatordata.get_tag_indices(year_tag)
+    bite_indices = [indicatordata.get_tag_indices(tag) for tag in bite_tags]
+    for row in rows:
+        iso3 = get_first_value(row, iso3_indices)
+        indicatordata.add_row(iso3, row)
+        countryindex.add_row(iso3, name, get_first_value(row, year_indices),
+                             [get_first_value(row, indices) for indices in bite_indices])
+    return indicatordata
+
+
+def parse_indicator(name, path):
+    """Reads the rows of an indicator's xlsx file into an IndicatorData returning it along with the summaries of its
+    countries and the seconds taken. It is run in a worker process when indicators are ingested concurrently so that
+    only the columns, not a list of rows, are sent back."""
+    start = time.perf_counter()
+    countryindex = CountryIndex()
+    headers, hxltags, data = read_hxl(path)
+    indicatordata = partition_rows(name, headers, hxltags, data, countryindex)
+    return indicatordata, countryindex.countries, time.perf_counter() - start
+
+
+def download_metadata(downloader, url):
+    with report.stage('download'):
+        return downloader.download_tabular_key_value(url)
+
+
+def download_indicators(downloader, folder, indicators, executor=None):
+    """Downloads the metadata and xlsx file of each indicator returning a list of metadata, path and, if an executor is
+    given, the future of parsing the file in a worker. Each file is submitted as soon as it is downloaded so that later
+    downloads overlap with parsing and files are parsed in parallel. If the downloader is a download cache, the
+    metadata sheets are then fetched concurrently, only once every worker has been forked, and parsed one at a time as
+    a Download object cannot be shared between threads."""
+    paths = list()
+    parsed = list()
+    for indicator in indicators:
+        with report.stage('download'):
+            path = downloader.download_file(indicator['url'], folder, '%s.xlsx' % indicator['name'])
+        paths.append(path)
+        if executor:
+            parsed.append(executor.submit(parse_indicator, indicator['name'], path))
+        else:
+            parsed.append(None)
+    fetch = getattr(downloader, 'fetch', None)
+    if fetch:
+        with report.stage('download'), ThreadPoolExecutor(max_workers=max(1, len(indicators))) as threads:
+            list(threads.map(lambda indicator: fetch(indicator['spreadsheet']), indicators))
+    metadata = [download_metadata(downloader, indicator['spreadsheet']) for indicator in indicators]
+    return list(zip(metadata, paths, parsed))
+
+
+def generate_indicator_datasets_and_showcase(downloader, folder, indicators, tags, workers=1):
+    """Generates the indicator datasets and showcase. If workers is more than 1, the xlsx files are parsed by that many
+    processes. Their results are merged in the order of indicators, not as they finish, so the output is the same as
+    when they are read one at a time."""
     datasets = dict()
     countriesdata = dict()
+    countryindex = CountryIndex()
     headersdata = dict()
-    for indicator in indicators:
-        metadata = downloader.download_tabular_key_value(indicator['spreadsheet'])
-        name = metadata['Indicator Name']
-        title = name
-        dataset = get_dataset(title, tags, 'idmc-%s' % name)
-        dataset['notes'] = "%s\n\nContains data from IDMC's [Global Internal Displacement Database](http://www.internal-displacement.org/database/displacement-data)." % metadata['Long definition']
-        dataset['methodology_other'] = metadata['Statistical concept and methodology']
-        dataset['caveats'] = metadata['Limitations and exceptions']
-        dataset.add_other_location('world')
-        url = indicator['url']
-        name = indicator['name']
-        path = downloader.download_file(url, folder, '%s.xlsx' % name)
-        data = hxl.data(path, allow_local=True)
-        headers = data.headers
-        hxltags = data.display_tags
-        headersdata[name] = headers, hxltags
-        years = set()
-        rows = [headers, hxltags]
-        for row in data:
-            newrow = list()
-            for hxltag in hxltags:
-                newrow.append(row.get(hxltag))
-            rows.append(newrow)
-            iso3 = row.get('#country+code')
-            epcountrydata = countriesdata.get(iso3, dict())
-            dict_of_lists_add(epcountrydata, name, row)
-            countriesdata[iso3] = epcountrydata
-            year = row.get('#date+year')
-            if year is None:
-                continue
-            years.add(year)
+    with ExitStack() as stack:
+        executor = None
+        if workers > 1:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=min(workers, len(indicators))))
+        downloads = download_indicators(downloader, folder, indicators, executor)
+        for indicator, (metadata, path, parsed) in zip(indicators, downloads):
+            name = metadata['Indicator Name']
+            title = name
+            dataset = get_dataset(title, tags, 'idmc-%s' % name)
+            dataset['notes'] = "%s\n\nContains data from IDMC's [Global Internal Displacement Database](http://www.internal-displacement.org/database/displacement-data)." % metadata['Long definition']
+            dataset['methodology_other'] = metadata['Statistical concept and methodology']
+            dataset['caveats'] = metadata['Limitations and exceptions']
+            dataset.add_other_location('world')
+            name = indicator['name']
+            with report.stage('ingest'):
+                if parsed:
+                    indicatordata, countries, seconds = parsed.result()
+                    report.add_stage('parse', seconds)
+                    countryindex.merge(countries)
+                    headers, hxltags = indicatordata.headers, indicatordata.hxltags
+                else:
+                    headers, hxltags, data = read_hxl(path)
+                    indicatordata = partition_rows(name, headers, hxltags, data, countryindex)
+                headersdata[name] = headers, hxltags
+            for iso3 in indicatordata.countryrows:
+                countriesdata.setdefault(iso3, dict())[name] = indicatordata
 
-        resourcedata = {'name': name, 'description': title}
-        filename = '%s.csv' % name
-        dataset.generate_resource_from_rows(folder, filename, rows, resourcedata)
+            resourcedata = {'name': name, 'description': title}
+            with report.stage('indicator csv') as written:
+                resource = write_resource(dataset, indicator.get('writer', 'csv'), folder, name, headers, hxltags,
+                                          indicatordata, resourcedata)
+                written['bytes'] = getsize(resource.get_file_to_upload())
 
-        years = sorted(list(years))
-        dataset.set_dataset_year_range(years[0], years[-1])
-        datasets[name] = dataset
+            dataset.set_dataset_year_range(*indicatordata.get_year_range())
+            datasets[name] = dataset
 
     title = 'IDMC Global Report on Internal Displacement'
     slugified_name = slugify(title).lower()
@@ -90,73 +298,125 @@ def generate_indicator_datasets_and_showcase(downloader, folder, indicators, tag
         'image_url': 'http://www.internal-displacement.org/global-report/grid2018/img/ogimage.jpg'
     })
     showcase.add_tags(tags)
-    return datasets, showcase, headersdata, countriesdata
+    return datasets, showcase, headersdata, countriesdata, countryindex
+
 
+@lru_cache(maxsize=None)
+def get_country_name(countryiso):
+    return Country.get_country_name_from_iso3(countryiso)
 
-def generate_country_dataset_and_showcase(downloader, folder, headersdata, countryiso, countrydata, indicator_datasets, tags):
+
+@lru_cache(maxsize=None)
+def get_unterm_name(countryiso):
+    return Country.get_country_info_from_iso3(countryiso)['#country+alt+i_en+name+v_unterm']
+
+
+def is_not_found(error):
+    """Returns True if a DownloadError was caused by a 404 response"""
+    response = getattr(error.__cause__, 'response', None)
+    return response is not None and response.status_code == 404
+
+
+def find_country_url(downloader, countryiso):
+    """Returns the IDMC page for a country trying its name and then its UNTERM name or None if neither exists. Raises
+    DownloadError if that can not be told, eg. because of a timeout or server error."""
+    countryname = get_country_name(countryiso)
+    if countryname is None:
+        return None
+    url = 'http://www.internal-displacement.org/countries/%s/' % countryname.replace(' ', '-')
+    try:
+        downloader.setup(url)
+    except DownloadError as e:
+        not_found = is_not_found(e)
+        url = 'http://www.internal-displacement.org/countries/%s/' % get_unterm_name(countryiso)
+        try:
+            downloader.setup(url)
+        except DownloadError as e:
+            if not_found and is_not_found(e):
+                return None
+            raise
+    return url
+
+
+def get_country_url(downloader, countryiso):
+    """Returns the IDMC page for a country trying its name and then its UNTERM name or None if there is neither or it
+    could not be reached"""
+    try:
+        return find_country_url(downloader, countryiso)
+    except DownloadError:
+        return None
+
+
+CountryTemplate = namedtuple('CountryTemplate', ['title', 'metadata', 'notes', 'methodology', 'caveats',
+                                                 'descriptions', 'showcase_tags', 'writers'])
+
+
+def get_country_template(indicator_datasets, tags, writers=None):
+    """Returns the metadata shared by all country datasets worked out once from the indicator datasets. writers is a
+    dictionary of indicator name to the writer of its country resources which defaults to csv."""
     indicator_datasets_list = indicator_datasets.values()
-    title = extract_list_from_list_of_dict(indicator_datasets_list, 'title')
-    countryname = Country.get_country_name_from_iso3(countryiso)
-    dataset = get_dataset('%s - %s' % (countryname, title[0]), tags,
-                          'IDMC IDP data for %s' % countryname)
+    title = extract_list_from_list_of_dict(indicator_datasets_list, 'title')[0]
+    dataset = Dataset()
+    add_common_metadata(dataset, tags)
+    metadata = MappingProxyType(dataset.data)
+    description = extract_list_from_list_of_dict(indicator_datasets_list, 'notes')
+    methodology = extract_list_from_list_of_dict(indicator_datasets_list, 'methodology_other')
+    caveats = extract_list_from_list_of_dict(indicator_datasets_list, 'caveats')
+    descriptions = MappingProxyType({endpoint: indicator_dataset.get_resources()[0]['description']
+                                     for endpoint, indicator_dataset in indicator_datasets.items()})
+    showcase = Showcase()
+    showcase.add_tags(tags)
+    return CountryTemplate(title=title, metadata=metadata,
+                           notes=get_matching_then_nonmatching_text(description, separator='\n\n', ignore='\n'),
+                           methodology=get_matching_then_nonmatching_text(methodology),
+                           caveats=get_matching_then_nonmatching_text(caveats), descriptions=descriptions,
+                           showcase_tags=tuple(showcase['tags']), writers=MappingProxyType(dict(writers or dict())))
+
+
+def generate_country_dataset_and_showcase(downloader, folder, headersdata, countryiso, countrydata, countryindex,
+                                          template, showcase_urls=None):
+    countryname = get_country_name(countryiso)
+    title = '%s - %s' % (countryname, template.title)
+    logger.info('Creating dataset: %s' % title)
+    dataset = Dataset({
+        'name': slugify('IDMC IDP data for %s' % countryname).lower(),
+        'title': title
+    })
+    for key, value in template.metadata.items():
+        dataset[key] = deepcopy(value)
     try:
         dataset.add_country_location(countryiso)
     except HDXError as e:
         logger.exception('%s has a problem! %s' % (countryname, e))
         return None, None, None
-    description = extract_list_from_list_of_dict(indicator_datasets_list, 'notes')
-    dataset['notes'] = get_matching_then_nonmatching_text(description, separator='\n\n', ignore='\n')
-    methodology = extract_list_from_list_of_dict(indicator_datasets_list, 'methodology_other')
-    dataset['methodology_other'] = get_matching_then_nonmatching_text(methodology)
-    caveats = extract_list_from_list_of_dict(indicator_datasets_list, 'caveats')
-    dataset['caveats'] = get_matching_then_nonmatching_text(caveats)
+    dataset['notes'] = template.notes
+    dataset['methodology_other'] = template.methodology
+    dataset['caveats'] = template.caveats
 
-    years = set()
-    bites_disabled = [True, True, True]
     for endpoint in countrydata:
-        data = countrydata[endpoint]
+        indicatordata = countrydata[endpoint]
         headers, hxltags = headersdata[endpoint]
-        rows = [headers, hxltags]
-        for row in data:
-            newrow = list()
-            for hxltag in hxltags:
-                newrow.append(row.get(hxltag))
-            rows.append(newrow)
-            year = row.get('#date+year')
-            conflict_stock = row.get('#affected+idps+ind+stock+conflict')
-            if conflict_stock:
-                bites_disabled[0] = False
-            conflict_new = row.get('#affected+idps+ind+newdisp+conflict')
-            if conflict_new:
-                bites_disabled[1] = False
-            disaster_new = row.get('#affected+idps+ind+newdisp+disaster')
-            if disaster_new:
-                bites_disabled[2] = False
-            if year is None:
-                continue
-            years.add(year)
-        name = indicator_datasets[endpoint].get_resources()[0]['description']
-        resourcedata = {'name': endpoint, 'description': '%s for %s' % (name, countryname)}
-        filename = '%s_%s.csv' % (endpoint, countryname)
-        dataset.generate_resource_from_rows(folder, filename, rows, resourcedata)
-    years = sorted(list(years))
-    dataset.set_dataset_year_range(years[0], years[-1])
-    url = 'http://www.internal-displacement.org/countries/%s/' % countryname.replace(' ', '-')
-    try:
-        downloader.setup(url)
-    except DownloadError:
-        altname = Country.get_country_info_from_iso3(countryiso)['#country+alt+i_en+name+v_unterm']
-        url = 'http://www.internal-displacement.org/countries/%s/' % altname
-        try:
-            downloader.setup(url)
-        except DownloadError:
-            return dataset, None, bites_disabled
+        resourcedata = {'name': endpoint, 'description': '%s for %s' % (template.descriptions[endpoint], countryname)}
+        with report.stage('country csv') as written:
+            resource = write_resource(dataset, template.writers.get(endpoint, 'csv'), folder,
+                                      '%s_%s' % (endpoint, countryname), headers, hxltags, indicatordata,
+                                      resourcedata, countryiso)
+            written['bytes'] = getsize(resource.get_file_to_upload())
+    dataset.set_dataset_year_range(*countryindex.get_year_range(countryiso))
+    bites_disabled = countryindex.get_bites_disabled(countryiso)
+    if showcase_urls is not None and countryiso in showcase_urls:
+        url = showcase_urls[countryiso]
+    else:
+        with report.stage('showcase url'):
+            url = get_country_url(downloader, countryiso)
+    if url is None:
+        return dataset, None, bites_disabled
     showcase = Showcase({
         'name': '%s-showcase' % dataset['name'],
         'title': 'IDMC %s Summary Page' % countryname,
         'notes': 'Click the image on the right to go to the IDMC summary page for the %s dataset' % countryname,
         'url': url,
-        'image_url': 'http://www.internal-displacement.org/sites/default/files/logo_0.png'
+        'image_url': 'http://www.internal-displacement.org/sites/default/files/logo_0.png',
+        'tags': [dict(tag) for tag in template.showcase_tags]
     })
-    showcase.add_tags(tags)
-    return dataset, showcase, bites_disabled
\ No newline at end of file
+    return dataset, showcase, bites_disabled
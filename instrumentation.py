@@ -0,0 +1,198 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Instrumentation:
+------------
+
+Records the wall time, growth in peak resident memory and bytes written of each stage of a run along with the number
+and latency of HTTP requests to each host, overall and per country, and saves them as a JSON run report with the peak
+resident memory of the run.
+
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+from os import replace
+from urllib.parse import urlparse
+
+from requests import RequestException
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def get_peak_rss_mb():
+    if resource is None:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def new_stage():
+    return {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'bytes': 0, 'max_rss_growth_mb': 0.0}
+
+
+def new_host():
+    return {'requests': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'errors': 0}
+
+
+class RunReport:
+    """Totals of each stage and of the HTTP requests to each host, overall and for the country being processed by the
+    current thread. Recording a stage costs two clock reads, a getrusage call and a lock so it can be left enabled.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.stages = dict()
+            self.hosts = dict()
+            self.countries = dict()
+
+    def get_country(self):
+        """Returns the totals of the country the current thread is processing or None"""
+        countryiso = getattr(self.local, 'countryiso', None)
+        if countryiso is None:
+            return None
+        country = self.countries.get(countryiso)
+        if country is None:
+            country = {'stages': dict(), 'hosts': dict()}
+            self.countries[countryiso] = country
+        return country
+
+    @contextmanager
+    def country(self, countryiso):
+        """Attributes stages and HTTP requests made by the current thread to countryiso"""
+        self.local.countryiso = countryiso
+        try:
+            yield
+        finally:
+            self.local.countryiso = None
+
+    @contextmanager
+    def stage(self, name):
+        """Times the enclosed block as a call of stage name. The yielded dictionary's bytes can be set to the number of
+        bytes the stage wrote. The growth of the process's peak resident memory during the block is recorded, which
+        includes what other threads allocated meanwhile and is 0 when the block stayed below an earlier peak."""
+        written = {'bytes': 0}
+        start_rss_mb = get_peak_rss_mb()
+        start = time.perf_counter()
+        try:
+            yield written
+        finally:
+            rss_growth_mb = None
+            if start_rss_mb is not None:
+                rss_growth_mb = round(get_peak_rss_mb() - start_rss_mb, 1)
+            self.add_stage(name, time.perf_counter() - start, written['bytes'], rss_growth_mb)
+
+    def add_stage(self, name, seconds, nbytes=0, rss_growth_mb=None):
+        with self.lock:
+            country = self.get_country()
+            totals = [self.stages]
+            if country is not None:
+                totals.append(country['stages'])
+            for stages in totals:
+                stage = stages.get(name)
+                if stage is None:
+                    stage = new_stage()
+                    stages[name] = stage
+                stage['calls'] += 1
+                stage['seconds'] += seconds
+                stage['max_seconds'] = max(stage['max_seconds'], seconds)
+                stage['bytes'] += nbytes
+                if rss_growth_mb is not None:
+                    stage['max_rss_growth_mb'] = max(stage['max_rss_growth_mb'], rss_growth_mb)
+
+    def add_country(self, countryiso, country):
+        """Adds the totals of a country recorded by another process, eg. a build worker, to this report"""
+        with self.lock:
+            existing = self.countries.setdefault(countryiso, {'stages': dict(), 'hosts': dict()})
+            for name, stage in country['stages'].items():
+                for stages in (self.stages, existing['stages']):
+                    total = stages.get(name)
+                    if total is None:
+                        total = new_stage()
+                        stages[name] = total
+                    total['calls'] += stage['calls']
+                    total['seconds'] += stage['seconds']
+                    total['max_seconds'] = max(total['max_seconds'], stage['max_seconds'])
+                    total['bytes'] += stage['bytes']
+                    total['max_rss_growth_mb'] = max(total['max_rss_growth_mb'], stage['max_rss_growth_mb'])
+            for host, stats in country['hosts'].items():
+                for hosts in (self.hosts, existing['hosts']):
+                    total = hosts.get(host)
+                    if total is None:
+                        total = new_host()
+                        hosts[host] = total
+                    for key in ('requests', 'seconds', 'errors'):
+                        total[key] += stats[key]
+                    total['max_seconds'] = max(total['max_seconds'], stats['max_seconds'])
+
+    def add_request(self, response, *args, **kwargs):
+        """Response hook for requests sessions recording the latency of each request by host"""
+        self.add_host_request(response.url, response.elapsed.total_seconds(), response.status_code >= 400)
+
+    def add_host_request(self, url, seconds, error=False):
+        host = urlparse(url).netloc
+        with self.lock:
+            country = self.get_country()
+            totals = [self.hosts]
+            if country is not None:
+                totals.append(country['hosts'])
+            for hosts in totals:
+                stats = hosts.get(host)
+                if stats is None:
+                    stats = new_host()
+                    hosts[host] = stats
+                stats['requests'] += 1
+                stats['seconds'] += seconds
+                stats['max_seconds'] = max(stats['max_seconds'], seconds)
+                if error:
+                    stats['errors'] += 1
+
+    def instrument_session(self, session):
+        """Records every request made with a requests session including those that fail without a response, eg.
+        because of a timeout or connection error, which response hooks never see"""
+        hooks = session.hooks['response']
+        if self.add_request in hooks:
+            return session
+        hooks.append(self.add_request)
+        send = session.send
+
+        def send_recording_failures(request, **kwargs):
+            start = time.perf_counter()
+            try:
+                return send(request, **kwargs)
+            except RequestException:
+                self.add_host_request(request.url, time.perf_counter() - start, True)
+                raise
+
+        session.send = send_recording_failures
+        return session
+
+    def get_report(self):
+        with self.lock:
+            return json.loads(json.dumps({
+                'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                'seconds': round(time.time() - self.started, 3),
+                'peak_rss_mb': get_peak_rss_mb(),
+                'stages': self.stages,
+                'hosts': self.hosts,
+                'countries': self.countries
+            }))
+
+    def save(self, path):
+        report = self.get_report()
+        temppath = '%s.part' % path
+        with open(temppath, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+        replace(temppath, path)
+        return report
+
+
+report = RunReport()
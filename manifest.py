@@ -0,0 +1,85 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Publish manifest:
+------------
+
+Records what was last created in HDX so that unchanged datasets and resource files are not uploaded again.
+
+"""
+import hashlib
+import json
+import threading
+from os import replace
+from os.path import exists
+
+
+def hash_file(path):
+    if path is None:
+        return None
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class PublishManifest:
+    """Content hashes of the metadata and resource files of each dataset when it was last created in HDX along with
+    the urls of its uploaded resources. It is saved to path every time a dataset is recorded and can be used from
+    several threads.
+    """
+    def __init__(self, path):
+        self.path = path
+        if exists(path):
+            with open(path) as f:
+                self.datasets = json.load(f)
+        else:
+            self.datasets = dict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_hashes(dataset, resourceview=None):
+        """Hashes dataset and resource metadata, resource view and resource files. Call before creating in HDX."""
+        metadata = [dataset.data, resourceview.data if resourceview else None]
+        resources = dict()
+        for resource in dataset.get_resources():
+            metadata.append(resource.data)
+            resources[resource['name']] = hash_file(resource.get_file_to_upload())
+        metadata = json.dumps(metadata, sort_keys=True, default=str).encode('utf-8')
+        return {'metadata': hashlib.sha256(metadata).hexdigest(), 'resources': resources}
+
+    def is_unchanged(self, dataset, hashes):
+        entry = self.datasets.get(dataset['name'])
+        if entry is None or entry['metadata'] != hashes['metadata']:
+            return False
+        resources = {name: resource['hash'] for name, resource in entry['resources'].items()}
+        return resources == hashes['resources']
+
+    def skip_unchanged_resources(self, dataset, hashes):
+        """Points resources whose files are unchanged at their existing urls so that they are not uploaded again.
+        Returns the number of resources skipped."""
+        entry = self.datasets.get(dataset['name'])
+        if entry is None:
+            return 0
+        skipped = 0
+        for resource in dataset.get_resources():
+            previous = entry['resources'].get(resource['name'])
+            if previous and previous['url'] and previous['hash'] == hashes['resources'][resource['name']]:
+                resource.file_to_upload = None
+                resource['url'] = previous['url']
+                skipped += 1
+        return skipped
+
+    def record(self, dataset, hashes):
+        """Records the hashes of a dataset that has been created in HDX along with the urls of its resources"""
+        resources = dict()
+        for resource in dataset.get_resources():
+            name = resource['name']
+            resources[name] = {'hash': hashes['resources'][name], 'url': resource.get('url')}
+        with self.lock:
+            self.datasets[dataset['name']] = {'metadata': hashes['metadata'], 'resources': resources}
+            temppath = '%s.part' % self.path
+            with open(temppath, 'w') as f:
+                json.dump(self.datasets, f, indent=1, sort_keys=True)
+            replace(temppath, self.path)
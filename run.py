@@ -4,14 +4,33 @@
 Top level script. Calls other functions that generate datasets that this script then creates in HDX.
 
 """
+import argparse
 import logging
-from os.path import join, expanduser
+import multiprocessing
+import signal
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from os import getenv, makedirs, remove
+from os.path import join, expanduser, dirname, exists
+from shutil import rmtree
 
+from hdx.data.showcase import Showcase
 from hdx.hdx_configuration import Configuration
+from hdx.location.country import Country
 from hdx.utilities.downloader import Download
 from hdx.utilities.path import temp_dir, multiple_progress_storing_tempdir, get_temp_dir
+from hdx.utilities.saver import save_str_to_file
 
-from idmc import generate_indicator_datasets_and_showcase, generate_country_dataset_and_showcase
+from downloadcache import DownloadCache
+from idmc import generate_indicator_datasets_and_showcase, generate_country_dataset_and_showcase, \
+    get_country_template
+from instrumentation import report
+from manifest import PublishManifest
+from scheduler import MetricsServer, Scheduler
+from showcaseurls import ShowcaseURLs
+from staging import get_staged_sources, load_manifest, load_staged_dataset, save_manifest, stage_dataset
 
 from hdx.facades.simple import facade
 
@@ -20,46 +39,288 @@ logger = logging.getLogger(__name__)
 lookup = 'hdx-scraper-idmc'
 
 
-def main():
-    """Generate dataset and create it in HDX"""
+@contextmanager
+def thread_downloaders():
+    """Yields a function returning a Download object for the calling thread. All are closed on exit."""
+    local = threading.local()
+    downloaders = list()
 
-    with Download() as downloader:
-        indicators = Configuration.read()['indicators']
-        tags = Configuration.read()['tags']
-        folder = get_temp_dir('IDMC')
-        datasets, showcase, headersdata, countriesdata = generate_indicator_datasets_and_showcase(downloader, folder, indicators, tags)
-        showcase_not_added = True
-        countries = [{'iso3': x} for x in sorted(countriesdata)]
-
-        logger.info('Number of indicator datasets to upload: %d' % len(indicators))
-        logger.info('Number of country datasets to upload: %d' % len(countries))
-        for i, info, nextdict in multiple_progress_storing_tempdir('IDMC', [indicators, countries],
-                                                                   ['name', 'iso3']):
-            folder = info['folder']
+    def get_downloader():
+        downloader = getattr(local, 'downloader', None)
+        if downloader is None:
+            downloader = Download()
+            report.instrument_session(downloader.session)
+            local.downloader = downloader
+            downloaders.append(downloader)
+        return downloader
+
+    try:
+        yield get_downloader
+    finally:
+        for downloader in downloaders:
+            downloader.close()
+
+
+def store_progress(info, progress):
+    """Point the progress files of multiple_progress_storing_tempdir at the oldest unfinished item"""
+    folder = info['folder']
+    for progress_folder in (folder, dirname(folder)):
+        save_str_to_file(progress, join(progress_folder, 'progress.txt'))
+
+
+def create_dataset(dataset, hashes, batch, manifest):
+    """Create dataset in HDX returning True unless the manifest shows that it is unchanged. Resources whose files are
+    unchanged are not uploaded again."""
+    if manifest.is_unchanged(dataset, hashes):
+        logger.info('%s is unchanged. Skipping!' % dataset['name'])
+        return False
+    skipped = manifest.skip_unchanged_resources(dataset, hashes)
+    if skipped:
+        logger.info('%s has %d unchanged resources which will not be uploaded' % (dataset['name'], skipped))
+    with report.stage('create_in_hdx'):
+        dataset.create_in_hdx(remove_additional_resources=True, hxl_update=False, updated_by_script='HDX Scraper: IDMC', batch=batch)
+    return True
+
+
+def get_resource_order(dataset):
+    """Returns the names of the resources of a country dataset in the order they are shown in HDX"""
+    return [x['name'] for x in sorted(dataset.get_resources(), key=lambda x: len(x['name']), reverse=True)]
+
+
+def generate_resource_view(dataset, **kwargs):
+    """Generate the quick charts of a dataset whose first resource is a csv, turning preview off otherwise"""
+    if dataset.get_resources()[0]['format'] != 'csv':
+        dataset.preview_off()
+        return None
+    return dataset.generate_resource_view(**kwargs)
+
+
+def build_country_dataset(folder, headersdata, countryiso, countrydata, countryindex, template, showcase_urls):
+    """Generate a country dataset and its resource view ready to be created in HDX or (None, None)"""
+    dataset, showcase, bites_disabled = \
+        generate_country_dataset_and_showcase(None, folder, headersdata, countryiso, countrydata,
+                                              countryindex, template, showcase_urls=showcase_urls)
+    if not dataset:
+        return None, None
+    dataset.update_from_yaml()
+    resourceview = generate_resource_view(dataset, bites_disabled=bites_disabled)
+    return dataset, resourceview
+
+
+def publish_country_dataset(dataset, resourceview, resource_order, batch, manifest):
+    hashes = manifest.get_hashes(dataset, resourceview)
+    if not create_dataset(dataset, hashes, batch, manifest):
+        return
+    resource_ids = {x['name']: x['id'] for x in dataset.get_resources()}
+    with report.stage('reorder_resources'):
+        dataset.reorder_resources([resource_ids[name] for name in resource_order], hxl_update=False)
+    manifest.record(dataset, hashes)
+
+
+# State of a build inherited by forked worker processes so that the ingested data does not need to be pickled. Workers
+# started any other way, eg. with spawn which is the default on Windows and macOS, would not see it.
+build_state = dict()
+
+
+def stage_country_dataset(countryiso):
+    """Build a country dataset into the staging folder returning its manifest entry or None"""
+    staging = build_state['staging']
+    folder = join(staging, 'countries', countryiso)
+    makedirs(folder, exist_ok=True)
+    with report.country(countryiso), report.stage('country'):
+        dataset, resourceview = build_country_dataset(folder, build_state['headersdata'], countryiso,
+                                                      build_state['countriesdata'][countryiso],
+                                                      build_state['countryindex'], build_state['template'],
+                                                      build_state['showcase_urls'])
+    if dataset is None:
+        rmtree(folder)
+        return None
+    return stage_dataset(staging, dataset, resourceview, get_resource_order(dataset), iso3=countryiso)
+
+
+def stage_country_dataset_in_worker(countryiso):
+    """Build a country dataset in a worker process returning its manifest entry or None along with what the worker
+    recorded about the country. What the parent recorded before forking is dropped so it is not added twice."""
+    report.countries.pop(countryiso, None)
+    entry = stage_country_dataset(countryiso)
+    return entry, report.countries.get(countryiso)
+
+
+def build(cache, staging, indicators, tags, config):
+    """Generate all datasets without calling HDX writing them to staging. Country datasets are built by a pool of
+    build_workers processes. The manifest of the previous build is removed first so that a build that fails partway
+    can not be published."""
+    build_workers = config.get('build_workers', 1)
+    if build_workers > 1 and multiprocessing.get_start_method() != 'fork':
+        raise ValueError('build_workers of more than 1 needs processes to be started with fork, not %s! '
+                         'Set build_workers to 1.' % multiprocessing.get_start_method())
+    manifest_path = join(staging, 'manifest.json')
+    if exists(manifest_path):
+        remove(manifest_path)
+    for path in (join(staging, 'indicators'), join(staging, 'countries')):
+        if exists(path):
+            rmtree(path)
+        makedirs(path)
+    folder = join(staging, 'indicators')
+    datasets, showcase, headersdata, countriesdata, countryindex = \
+        generate_indicator_datasets_and_showcase(cache, folder, indicators, tags,
+                                                 workers=config.get('ingest_workers', 1))
+    countryindex.save(join(staging, 'countryindex.json'))
+    indicator_entries = list()
+    for indicator in indicators:
+        dataset = datasets[indicator['name']]
+        dataset.update_from_yaml()
+        resourceview = generate_resource_view(dataset, path=join('config', indicator['resourceview']))
+        indicator_entries.append(stage_dataset(staging, dataset, resourceview, name=indicator['name']))
+
+    Country.countriesdata()  # load once here rather than in every worker
+    countryisos = sorted(countriesdata)
+    with thread_downloaders() as get_downloader:
+        showcase_urls = ShowcaseURLs(join(get_temp_dir('IDMC-publish'), 'showcase_urls.json'),
+                                     ttl_days=config.get('showcase_ttl_days', 30))
+        with report.stage('showcase urls'):
+            showcase_urls = showcase_urls.resolve(countryisos, get_downloader,
+                                                  workers=config.get('showcase_workers', 8))
+
+    writers = {indicator['name']: indicator.get('country_writer', 'csv') for indicator in indicators}
+    logger.info('Building %d country datasets using %d processes' % (len(countryisos), build_workers))
+    build_state.update({'staging': staging, 'headersdata': headersdata, 'countriesdata': countriesdata,
+                        'countryindex': countryindex, 'template': get_country_template(datasets, tags, writers),
+                        'showcase_urls': showcase_urls})
+    country_entries = list()
+    try:
+        if build_workers > 1:
+            with ProcessPoolExecutor(max_workers=build_workers) as executor:
+                for countryiso, (entry, country) in zip(countryisos, executor.map(stage_country_dataset_in_worker,
+                                                                                   countryisos, chunksize=8)):
+                    if country:
+                        report.add_country(countryiso, country)
+                    if entry:
+                        country_entries.append(entry)
+        else:
+            for countryiso in countryisos:
+                entry = stage_country_dataset(countryiso)
+                if entry:
+                    country_entries.append(entry)
+    finally:
+        build_state.clear()
+    return save_manifest(staging, showcase, indicator_entries, country_entries, cache.get_hashes())
+
+
+def publish(cache, staging, workers):
+    """Create the datasets in the staging manifest in HDX using up to workers threads"""
+    staged = load_manifest(staging)
+    manifest = PublishManifest(join(get_temp_dir('IDMC-publish'), 'manifest.json'))
+    showcase = Showcase(staged['showcase'])
+    showcase_not_added = True
+    countries = staged['countries']
+    logger.info('Number of indicator datasets to upload: %d' % len(staged['indicators']))
+    logger.info('Number of country datasets to upload: %d using %d workers' % (len(countries), workers))
+    lastiso = countries[-1]['iso3'] if countries else None
+    # Country datasets are created concurrently in a window of at most workers in flight. The progress file is
+    # kept pointing at the oldest unfinished country, before waiting on any of them, so that a resumed run never
+    # skips one, even if an upload fails.
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for i, info, entry in multiple_progress_storing_tempdir('IDMC', [staged['indicators'], countries],
+                                                                ['name', 'iso3']):
             batch = info['batch']
             if i == 0:
                 if showcase_not_added:
-                    showcase.create_in_hdx()
+                    with report.stage('create_in_hdx'):
+                        showcase.create_in_hdx()
                     showcase_not_added = False
-                dataset = datasets[nextdict['name']]
-                dataset.update_from_yaml()
-                dataset.generate_resource_view(join('config', nextdict['resourceview']))
-                dataset.create_in_hdx(remove_additional_resources=True, hxl_update=False, updated_by_script='HDX Scraper: IDMC', batch=batch)
-                showcase.add_dataset(dataset)
+                dataset, resourceview = load_staged_dataset(staging, entry)
+                hashes = manifest.get_hashes(dataset, resourceview)
+                if create_dataset(dataset, hashes, batch, manifest):
+                    showcase.add_dataset(dataset)
+                    manifest.record(dataset, hashes)
             else:
-                countryiso = nextdict['iso3']
-                countrydata = countriesdata[countryiso]
-                dataset, showcase, bites_disabled = \
-                    generate_country_dataset_and_showcase(downloader, folder, headersdata, countryiso, countrydata, datasets, tags)
-                if dataset:
-                    dataset.update_from_yaml()
-                    dataset.generate_resource_view(bites_disabled=bites_disabled)
-                    dataset.create_in_hdx(remove_additional_resources=True, hxl_update=False, updated_by_script='HDX Scraper: IDMC', batch=batch)
-                    resources = dataset.get_resources()
-                    resource_ids = [x['id'] for x in sorted(resources, key=lambda x: len(x['name']), reverse=True)]
-                    dataset.reorder_resources(resource_ids, hxl_update=False)
+                countryiso = entry['iso3']
+                future = executor.submit(publish_staged_country_dataset, staging, entry, batch, manifest)
+                pending.append((info['progress'], future))
+                store_progress(info, pending[0][0])
+                while len(pending) >= workers or (pending and countryiso == lastiso):
+                    pending.popleft()[1].result()
+                if pending:
+                    store_progress(info, pending[0][0])
+    cache.mark_completed(staged['sources'])
 
 
-if __name__ == '__main__':
-    facade(main, user_agent_config_yaml=join(expanduser('~'), '.useragents.yml'), user_agent_lookup=lookup, project_config_yaml=join('config', 'project_configuration.yml'))
+def publish_staged_country_dataset(staging, entry, batch, manifest):
+    with report.country(entry['iso3']), report.stage('country'):
+        dataset, resourceview = load_staged_dataset(staging, entry)
+        publish_country_dataset(dataset, resourceview, entry['resource_order'], batch, manifest)
+
 
+def run(config, cache, staging, mode='all', reuse_staged=False):
+    """Build and/or publish returning the run report or None if no IDMC source has changed since the last completed
+    run. If reuse_staged is True, the build in staging is published without building again when it was made from the
+    current IDMC sources."""
+    report.reset()
+    cache.start_run()
+    if mode != 'publish':
+        indicators = config['indicators']
+        urls = [indicator[key] for indicator in indicators for key in ('spreadsheet', 'url')]
+        if not cache.has_changed(urls) and not getenv('WHERETOSTART'):
+            logger.info('No IDMC source has changed since the last completed run. Nothing to do!')
+            return None
+        if reuse_staged and get_staged_sources(staging) == cache.get_hashes():
+            logger.info('Publishing the build already staged from the current IDMC sources')
+        else:
+            build(cache, staging, indicators, config['tags'], config)
+    if mode != 'build':
+        report.instrument_session(config.remoteckan().session)
+        publish(cache, staging, config.get('workers', 1))
+    summary = report.save(join(get_temp_dir('IDMC-publish'), 'run_report.json'))
+    for name, stage in sorted(summary['stages'].items()):
+        logger.info('%s: %d calls taking %.1fs writing %d bytes' % (name, stage['calls'], stage['seconds'], stage['bytes']))
+    for host, stats in sorted(summary['hosts'].items()):
+        logger.info('%s: %d requests taking %.1fs' % (host, stats['requests'], stats['seconds']))
+    return summary
+
+
+def serve(config, cache, staging):
+    """Poll the IDMC sources every poll_interval_minutes, building and publishing when any has changed, until
+    SIGTERM or SIGINT. The download session, HDX session, country lookups and download cache are kept between runs.
+    If metrics_port is set, the outcome of the last poll and report of the last run are served there as JSON on
+    metrics_host, 127.0.0.1 unless set."""
+    scheduler = Scheduler(lambda: run(config, cache, staging, reuse_staged=True),
+                          config.get('poll_interval_minutes', 60))
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: scheduler.stop())
+    with ExitStack() as stack:
+        port = config.get('metrics_port')
+        if port is not None:
+            server = stack.enter_context(MetricsServer(scheduler, port, config.get('metrics_host', '127.0.0.1')))
+            logger.info('Serving metrics on %s port %d' % (server.server.server_address[0], server.port))
+        scheduler.run_forever()
+
+
+def main(mode='all', staging=None):
+    """Generate datasets and create them in HDX. In build mode, datasets are only generated and saved to the staging
+    folder and in publish mode, the datasets last saved there are created in HDX. daemon mode keeps running, doing
+    both whenever an IDMC source changes."""
+
+    config = Configuration.read()
+    if staging is None:
+        staging = get_temp_dir('IDMC-staging')
+    with Download() as downloader:
+        report.instrument_session(downloader.session)
+        cache = DownloadCache(downloader, get_temp_dir('IDMC-cache'),
+                              max_age_days=config.get('cache_max_age_days', 30),
+                              max_size_mb=config.get('cache_max_size_mb', 1000))
+        if mode == 'daemon':
+            serve(config, cache, staging)
+        else:
+            run(config, cache, staging, mode)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='IDMC scraper')
+    parser.add_argument('mode', nargs='?', default='all', choices=['all', 'build', 'publish', 'daemon'],
+                        help='build datasets to the staging folder, publish them from it, do both (default) or keep '
+                             'doing both whenever an IDMC source changes')
+    parser.add_argument('--staging', help='Staging folder. Defaults to IDMC-staging in the temporary folder.')
+    args = parser.parse_args()
+    facade(lambda: main(args.mode, args.staging), user_agent_config_yaml=join(expanduser('~'), '.useragents.yml'), user_agent_lookup=lookup, project_config_yaml=join('config', 'project_configuration.yml'))
@@ -0,0 +1,122 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Scheduler:
+------------
+
+Runs a poll function on a fixed schedule in a long running process, keeping the outcome of the last poll and the
+report of the last run so that they can be served as JSON metrics over HTTP.
+
+"""
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+logger = logging.getLogger(__name__)
+
+
+def format_time(timestamp):
+    if timestamp is None:
+        return None
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(timestamp))
+
+
+class Scheduler:
+    """Calls poll every interval_minutes, timed from the start of each poll, until stop is called. poll returns the
+    report of the run it made or None if there was nothing to do. An exception is logged and the next poll goes ahead
+    as scheduled.
+    """
+    def __init__(self, poll, interval_minutes=60):
+        self.poll = poll
+        self.interval = interval_minutes * 60
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.polls = 0
+        self.runs = 0
+        self.errors = 0
+        self.last_poll = None
+        self.last_run = None
+        self.next_poll = None
+        self.last_error = None
+        self.report = None
+
+    def poll_once(self):
+        start = time.time()
+        try:
+            report = self.poll()
+            error = None
+        except Exception as e:
+            logger.exception('Poll failed!')
+            report = None
+            error = '%s: %s' % (type(e).__name__, e)
+        with self.lock:
+            self.polls += 1
+            self.last_poll = start
+            if error:
+                self.errors += 1
+                self.last_error = error
+            elif report is not None:
+                self.runs += 1
+                self.last_run = start
+                self.report = report
+            self.next_poll = start + self.interval
+
+    def run_forever(self):
+        logger.info('Polling every %d minutes' % (self.interval // 60))
+        while not self.stopping.is_set():
+            self.poll_once()
+            self.stopping.wait(max(0, self.next_poll - time.time()))
+
+    def stop(self):
+        """Stops after the poll in progress, if any, has finished"""
+        self.stopping.set()
+
+    def get_metrics(self):
+        with self.lock:
+            return {
+                'polls': self.polls,
+                'runs': self.runs,
+                'errors': self.errors,
+                'last_poll': format_time(self.last_poll),
+                'last_run': format_time(self.last_run),
+                'next_poll': format_time(self.next_poll),
+                'last_error': self.last_error,
+                'report': self.report
+            }
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsServer:
+    """Serves the metrics of a scheduler as JSON on port from a background thread. They are not authenticated so by
+    default only local connections are accepted."""
+    def __init__(self, scheduler, port, host='127.0.0.1'):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(scheduler.get_metrics(), indent=1, sort_keys=True).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self.server.server_port
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,74 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Showcase urls:
+------------
+
+Resolves the IDMC page of each country concurrently, remembering the results between runs.
+
+"""
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import replace
+from os.path import exists
+
+from hdx.utilities.downloader import DownloadError
+
+from idmc import find_country_url
+from instrumentation import report
+
+logger = logging.getLogger(__name__)
+
+
+class ShowcaseURLs:
+    """IDMC country page urls by iso3, or None where a country has no page, saved to path with the time each was
+    resolved. Results older than ttl_days are resolved again.
+    """
+    def __init__(self, path, ttl_days=30):
+        self.path = path
+        self.ttl = ttl_days * 86400
+        if exists(path):
+            with open(path) as f:
+                self.urls = json.load(f)
+        else:
+            self.urls = dict()
+
+    def get_expired(self, countryisos):
+        now = time.time()
+        return [countryiso for countryiso in countryisos
+                if countryiso not in self.urls or now - self.urls[countryiso]['resolved'] > self.ttl]
+
+    @staticmethod
+    def probe(downloader, countryiso):
+        """Returns the url of a country's page, None if it has none or False if that could not be told"""
+        with report.country(countryiso), report.stage('showcase url'):
+            try:
+                return find_country_url(downloader, countryiso)
+            except DownloadError as e:
+                logger.warning('Could not tell whether %s has an IDMC page! %s' % (countryiso, e))
+                return False
+
+    def resolve(self, countryisos, get_downloader, workers=8):
+        """Resolves urls for countries that are new or expired using up to workers concurrent probes. get_downloader
+        must return a Download object that can be used by the calling thread. Returns a dictionary of iso3 to url.
+        Only pages that exist or gave 404 are remembered. Countries whose probes failed otherwise keep any earlier
+        result, or None if there is none, and are probed again on the next run."""
+        expired = self.get_expired(countryisos)
+        logger.info('Resolving IDMC page urls for %d of %d countries' % (len(expired), len(countryisos)))
+        if expired:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                urls = executor.map(lambda countryiso: self.probe(get_downloader(), countryiso), expired)
+                for countryiso, url in zip(expired, urls):
+                    if url is not False:
+                        self.urls[countryiso] = {'url': url, 'resolved': time.time()}
+            self.save()
+        return {countryiso: self.urls[countryiso]['url'] if countryiso in self.urls else None
+                for countryiso in countryisos}
+
+    def save(self):
+        temppath = '%s.part' % self.path
+        with open(temppath, 'w') as f:
+            json.dump(self.urls, f, indent=1, sort_keys=True)
+        replace(temppath, self.path)
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Staging:
+------------
+
+Saves built datasets with their resource files, resource view and resource order to a staging folder and a manifest
+so that they can be published to HDX later by another process.
+
+"""
+import json
+import time
+from os import replace
+from os.path import exists, join, relpath
+
+from hdx.data.dataset import Dataset
+from hdx.data.resource import Resource
+from hdx.data.resource_view import ResourceView
+
+
+def stage_dataset(staging, dataset, resourceview=None, resource_order=None, **keys):
+    """Returns the manifest entry of a dataset whose resource files have been written under the staging folder. keys
+    are added to the entry to identify it."""
+    resources = list()
+    for resource in dataset.get_resources():
+        resources.append({'data': resource.data, 'file': relpath(resource.get_file_to_upload(), staging)})
+    entry = dict(keys)
+    entry.update({
+        'dataset': dataset.data,
+        'resources': resources,
+        'resourceview': resourceview.data if resourceview else None,
+        'resource_order': resource_order
+    })
+    return entry
+
+
+def load_staged_dataset(staging, entry):
+    """Returns the dataset and pending resource view of a manifest entry ready to be created in HDX"""
+    dataset = Dataset(entry['dataset'])
+    for resource in entry['resources']:
+        resource_object = Resource(resource['data'])
+        resource_object.set_file_to_upload(join(staging, resource['file']))
+        dataset.add_update_resource(resource_object)
+    resourceview = None
+    if entry['resourceview']:
+        resourceview = ResourceView(entry['resourceview'])
+        dataset.preview_resourceview = resourceview
+    return dataset, resourceview
+
+
+def save_manifest(staging, showcase, indicators, countries, sources):
+    """Saves the manifest of a build. sources are the content hashes of the IDMC files it was built from."""
+    manifest = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'sources': sources,
+        'showcase': showcase.data,
+        'indicators': indicators,
+        'countries': countries
+    }
+    path = join(staging, 'manifest.json')
+    temppath = '%s.part' % path
+    with open(temppath, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    replace(temppath, path)
+    return manifest
+
+
+def load_manifest(staging):
+    with open(join(staging, 'manifest.json')) as f:
+        return json.load(f)
+
+
+def get_staged_sources(staging):
+    """Returns the content hashes of the IDMC files the build in staging was made from or None if there is none"""
+    if not exists(join(staging, 'manifest.json')):
+        return None
+    return load_manifest(staging)['sources']
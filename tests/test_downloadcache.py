@@ -0,0 +1,127 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+Unit tests for download cache.
+
+'''
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from os.path import join, exists
+
+import pytest
+from hdx.data.vocabulary import Vocabulary
+from hdx.hdx_configuration import Configuration
+from hdx.hdx_locations import Locations
+from hdx.utilities.downloader import Download, DownloadError
+from hdx.utilities.path import temp_dir
+
+from downloadcache import DownloadCache
+from idmc import generate_indicator_datasets_and_showcase
+
+
+class TestDownloadCache:
+    @pytest.fixture(scope='function')
+    def server(self):
+        class Server(HTTPServer):
+            contents = {'/metadata.csv': b'Indicator Name,IDPs\nLong definition,Description\n'}
+            requests = list()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.server.requests.append((self.path, self.headers.get('If-None-Match')))
+                content = self.server.contents.get(self.path)
+                if content is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                etag = '"%d"' % hash(content)
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = Server(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+        server.server_close()
+
+    def test_download_cache(self, server):
+        url = 'http://127.0.0.1:%d/metadata.csv' % server.server_port
+        with temp_dir('idmc-cache') as folder:
+            cachefolder = join(folder, 'cache')
+            with Download(user_agent='test') as downloader:
+                cache = DownloadCache(downloader, cachefolder)
+                assert cache.download_tabular_key_value(url) == {'Indicator Name': 'IDPs', 'Long definition': 'Description'}
+                path = cache.download_file(url, folder, 'metadata.csv')
+                assert path == join(folder, 'metadata.csv')
+                assert server.requests == [('/metadata.csv', None)]
+                assert cache.has_changed([url]) is True
+                cache.mark_completed()
+
+                cache = DownloadCache(downloader, cachefolder)
+                assert cache.has_changed([url]) is False
+                assert server.requests[-1] == ('/metadata.csv', cache.entries[url]['etag'])
+
+                server.contents['/metadata.csv'] = b'Indicator Name,New IDPs\n'
+                cache = DownloadCache(downloader, cachefolder)
+                assert cache.has_changed([url]) is True
+                assert cache.download_tabular_key_value(url) == {'Indicator Name': 'New IDPs'}
+                assert len(server.requests) == 3
+                cache.mark_completed()
+
+                server.contents['/metadata.csv'] = b'Indicator Name,Old IDPs\n'
+                assert cache.has_changed([url]) is False
+                cache.start_run()
+                assert cache.has_changed([url]) is True
+                assert len(server.requests) == 4
+
+                cache = DownloadCache(downloader, cachefolder, max_age_days=0)
+                cache.entries[url]['last_used'] = time.time() - 1
+                cache.save()
+                assert cache.entries == dict()
+                assert not exists(cache.get_path(url))
+
+                with pytest.raises(DownloadError):
+                    cache.fetch('http://127.0.0.1:%d/missing.csv' % server.server_port)
+
+    def test_indicators(self, server):
+        Configuration._create(hdx_read_only=True, user_agent='test',
+                              project_config_yaml=join('tests', 'config', 'project_configuration.yml'))
+        Locations.set_validlocations([{'name': 'world', 'title': 'World'}])
+        Vocabulary._tags_dict = True
+        Vocabulary._approved_vocabulary = {'tags': [{'name': 'hxl'}], 'id': '4e61d464-4943-4e97-973a-84673c1aaa87', 'name': 'approved'}
+        with open(join('tests', 'fixtures', 'idmc_displacement_all_dataset.xlsx'), 'rb') as f:
+            server.contents['/idps.xlsx'] = f.read()
+        baseurl = 'http://127.0.0.1:%d' % server.server_port
+        indicators = list()
+        for i in range(8):
+            definition = ','.join(['"Description %d"' % i] * 200)
+            server.contents['/metadata%d.csv' % i] = ('Indicator Name,IDPs %d\nLong definition,%s\n'
+                                                      'Statistical concept and methodology,Methodology %d\n'
+                                                      'Limitations and exceptions,Caveats %d\n'
+                                                      % (i, definition, i, i)).encode('utf-8')
+            indicators.append({'name': 'indicator%d' % i, 'url': '%s/idps.xlsx' % baseurl,
+                               'spreadsheet': '%s/metadata%d.csv' % (baseurl, i)})
+        with temp_dir('idmc-cache') as folder:
+            with Download(user_agent='test') as downloader:
+                cache = DownloadCache(downloader, join(folder, 'cache'))
+                for _ in range(3):
+                    cache.start_run()
+                    datasets, _, _, _, _ = generate_indicator_datasets_and_showcase(cache, folder, indicators, ['hxl'])
+                    for i in range(8):
+                        dataset = datasets['indicator%d' % i]
+                        assert dataset['title'] == 'IDPs %d' % i
+                        assert dataset['notes'].startswith('Description %d\n' % i)
+                        assert dataset['methodology_other'] == 'Methodology %d' % i
+                        assert dataset['caveats'] == 'Caveats %d' % i
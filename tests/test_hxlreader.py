@@ -0,0 +1,46 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+Unit tests for HXL reader.
+
+'''
+import datetime
+from os.path import join
+
+import hxl
+import pytest
+from hdx.utilities.path import temp_dir
+from openpyxl import Workbook
+
+from hxlreader import read_hxl
+
+
+class TestHXLReader:
+    @staticmethod
+    def read_all(path):
+        headers, hxltags, rows = read_hxl(path)
+        return headers, hxltags, [list(row) for row in rows]
+
+    @pytest.mark.parametrize('filename', ['idmc_displacement_all_dataset.xlsx', 'idmc_disaster_all_dataset.xlsx'])
+    def test_fixtures(self, filename):
+        path = join('tests', 'fixtures', filename)
+        data = hxl.data(path, allow_local=True)
+        expected = [[row.get(hxltag) for hxltag in data.display_tags] for row in data]
+        assert self.read_all(path) == (data.headers, data.display_tags, expected)
+
+    def test_cell_types(self):
+        with temp_dir('idmc-hxlreader') as folder:
+            workbook = Workbook()
+            sheet = workbook.active
+            sheet.append(['Title of the export'])
+            sheet.append(['ISO3', 'Year', 'Start Date', 'Total', 'Flag', 'Total Again'])
+            sheet.append(['#country+code', '#date+year', '#date+start', '#affected+IDPS', '#indicator', '#affected+idps+total'])
+            sheet.append(['AFG', 2018, datetime.datetime(2018, 7, 1), 1.5, True, 3])
+            sheet.append(['TZA', 2019.0, '2019-01-02', 0, False, 4])
+            sheet.append([None, None, None, None, None, None])
+            sheet.append(['SDN', 2017])
+            path = join(folder, 'types.xlsx')
+            workbook.save(path)
+            headers, hxltags, rows = self.read_all(path)
+            assert hxltags == ['#country+code', '#date+year', '#date+start', '#affected+idps', '#indicator', '#affected+idps+total']
+            assert rows[:2] == [['AFG', 2018, '2018-07-01', 1.5, 1, 3], ['TZA', 2019, '2019-01-02', 4, None, 4]]
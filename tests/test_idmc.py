@@ -15,7 +15,9 @@ from hdx.utilities.compare import assert_files_same
 from hdx.utilities.downloader import DownloadError
 from hdx.utilities.path import temp_dir
 
-from idmc import generate_indicator_datasets_and_showcase, generate_country_dataset_and_showcase
+from hxlreader import get_first_value
+from idmc import generate_indicator_datasets_and_showcase, generate_country_dataset_and_showcase, IndicatorData, \
+    CountryIndex, get_country_template
 
 
 class TestIDMC:
@@ -75,12 +77,37 @@ class TestIDMC:
 
         return Download()
 
-    def test_generate_datasets_and_showcase(self, configuration, downloader):
+    def test_indicatordata(self):
+        indicatordata = IndicatorData(['ISO3', 'Year', 'Value'], ['#country+code', '#date+year', '#affected+idps+ind'])
+        indicatordata.add_row('AFG', ['AFG', 2017, 10])
+        indicatordata.add_row('TZA', ['TZA', 2017, None])
+        indicatordata.add_row('AFG', ['AFG', 2018, 20])
+        assert len(indicatordata) == 3
+        assert list(indicatordata.get_rows('AFG')) == [['AFG', 2017, 10], ['AFG', 2018, 20]]
+        assert list(indicatordata.get_rows('AB9')) == list()
+        assert list(indicatordata.get_rows()) == [['AFG', 2017, 10], ['TZA', 2017, None], ['AFG', 2018, 20]]
+        indices = indicatordata.get_tag_indices('#affected')
+        assert indices == (2,)
+        assert get_first_value(['TZA', 2017, None], indices) is None
+        assert get_first_value(['AFG', 2018, 20], indices) == 20
+        assert indicatordata.get_values('#affected') == [10, None, 20]
+        assert indicatordata.get_year_range() == (2017, 2018)
+        assert indicatordata.get_year_range('TZA') == (2017, 2017)
+
+        indicatordata = IndicatorData(['ISO3', 'Year', 'Value', 'Other Value'], ['#country+code', '#date+year', '#affected', '#affected'])
+        indicatordata.add_row('AFG', ['AFG', 2017, 0, 5])
+        indicatordata.add_row('AFG', ['AFG', 2018, 7, 6])
+        indicatordata.add_row('AFG', ['AFG', '', None, ''])
+        assert indicatordata.get_values('#affected', 'AFG') == [5, 7, None]
+        assert indicatordata.get_year_range('AFG') == (2017, 2018)
+
+    @pytest.mark.parametrize('workers', [1, 2])
+    def test_generate_datasets_and_showcase(self, configuration, downloader, workers):
         with temp_dir('idmc') as folder:
 # indicator dataset test
             indicators = Configuration.read()['indicators']
             tags = Configuration.read()['tags']
-            datasets, showcase, headersdata, countriesdata = generate_indicator_datasets_and_showcase(downloader, folder, indicators, tags)
+            datasets, showcase, headersdata, countriesdata, countryindex = generate_indicator_datasets_and_showcase(downloader, folder, indicators, tags, workers)
             assert datasets == {'displacement_data': {'name': 'idmc-internally-displaced-persons-idps', 'title': 'Internally displaced persons - IDPs',
                                                       'maintainer': '196196be-6037-4488-8b71-d786adf4c081', 'owner_org': '647d9d8c-4cac-4c33-b639-649aad1c2893',
                                                       'data_update_frequency': '365', 'subnational': '0',
@@ -117,8 +144,23 @@ class TestIDMC:
                                 'tags': [{'name': 'hxl', 'vocabulary_id': '4e61d464-4943-4e97-973a-84673c1aaa87'}, {'name': 'displacement', 'vocabulary_id': '4e61d464-4943-4e97-973a-84673c1aaa87'},
                                          {'name': 'internally displaced persons - idp', 'vocabulary_id': '4e61d464-4943-4e97-973a-84673c1aaa87'}, {'name': 'violence and conflict', 'vocabulary_id': '4e61d464-4943-4e97-973a-84673c1aaa87'}],
                                 'title': 'IDMC Global Report on Internal Displacement', 'url': 'http://www.internal-displacement.org/global-report/grid2018/'}
+            assert countryindex.countries == {'AB9': {'startyear': 2014, 'endyear': 2018, 'rows': {'displacement_data': 1, 'disaster_data': 1}, 'bites': [True, False, True]},
+                                              'AFG': {'startyear': 2008, 'endyear': 2018, 'rows': {'displacement_data': 3, 'disaster_data': 3}, 'bites': [True, True, True]},
+                                              'TZA': {'startyear': 2011, 'endyear': 2012, 'rows': {'displacement_data': 2, 'disaster_data': 2}, 'bites': [False, False, True]}}
+            path = join(folder, 'countryindex.json')
+            countryindex.save(path)
+            countryindex = CountryIndex.load(path)
+            assert countryindex.get_year_range('TZA') == (2011, 2012)
+            assert countryindex.get_row_counts('AFG') == {'displacement_data': 3, 'disaster_data': 3}
+            assert countryindex.get_bites_disabled('TZA') == [True, True, False]
 #  country datasets tests
-            dataset, showcase, disables_bites = generate_country_dataset_and_showcase(downloader, folder, headersdata, 'AFG', countriesdata['AFG'], datasets, tags)
+            template = get_country_template(datasets, tags)
+            assert template.title == 'Internally displaced persons - IDPs'
+            assert template.descriptions == {'displacement_data': 'Internally displaced persons - IDPs',
+                                             'disaster_data': 'Internally displaced persons - IDPs (new displacement associated with disasters)'}
+            with pytest.raises(TypeError):
+                template.metadata['maintainer'] = 'someone else'
+            dataset, showcase, disables_bites = generate_country_dataset_and_showcase(downloader, folder, headersdata, 'AFG', countriesdata['AFG'], countryindex, template)
             assert dataset == TestIDMC.afg_dataset
             resources = dataset.get_resources()
             assert resources == [{'description': 'Internally displaced persons - IDPs for Afghanistan', 'format': 'csv', 'name': 'displacement_data', 'resource_type': 'file.upload', 'url_type': 'upload'},
@@ -138,7 +180,7 @@ class TestIDMC:
                                          {'name': 'internally displaced persons - idp', 'vocabulary_id': '4e61d464-4943-4e97-973a-84673c1aaa87'}, {'name': 'violence and conflict', 'vocabulary_id': '4e61d464-4943-4e97-973a-84673c1aaa87'}]}
             assert disables_bites == [False, False, False]
 
-            dataset, showcase, disables_bites = generate_country_dataset_and_showcase(downloader, folder, headersdata, 'TZA', countriesdata['TZA'], datasets, tags)
+            dataset, showcase, disables_bites = generate_country_dataset_and_showcase(downloader, folder, headersdata, 'TZA', countriesdata['TZA'], countryindex, template)
             assert dataset == {'name': 'idmc-idp-data-for-united-republic-of-tanzania', 'title': 'United Republic of Tanzania - Internally displaced persons - IDPs', 'maintainer': '196196be-6037-4488-8b71-d786adf4c081',
                                'owner_org': '647d9d8c-4cac-4c33-b639-649aad1c2893', 'data_update_frequency': '365', 'subnational': '0',
                                'tags': [{'name': 'hxl', 'vocabulary_id': '4e61d464-4943-4e97-973a-84673c1aaa87'}, {'name': 'displacement', 'vocabulary_id': '4e61d464-4943-4e97-973a-84673c1aaa87'},
@@ -163,7 +205,12 @@ class TestIDMC:
                                          {'name': 'internally displaced persons - idp', 'vocabulary_id': '4e61d464-4943-4e97-973a-84673c1aaa87'}, {'name': 'violence and conflict', 'vocabulary_id': '4e61d464-4943-4e97-973a-84673c1aaa87'}]}
             assert disables_bites == [True, True, False]
 
-            dataset, showcase, disables_bites = generate_country_dataset_and_showcase(downloader, folder, headersdata, 'AB9', countriesdata['AB9'], datasets, tags)
+            dataset, showcase, disables_bites = generate_country_dataset_and_showcase(downloader, folder, headersdata, 'TZA', countriesdata['TZA'], countryindex, template,
+                                                                                      showcase_urls={'TZA': None})
+            assert dataset['name'] == 'idmc-idp-data-for-united-republic-of-tanzania'
+            assert showcase is None
+
+            dataset, showcase, disables_bites = generate_country_dataset_and_showcase(downloader, folder, headersdata, 'AB9', countriesdata['AB9'], countryindex, template)
             assert dataset is None
             assert showcase is None
             assert disables_bites is None
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+Unit tests for instrumentation.
+
+'''
+import json
+from datetime import timedelta
+from os.path import join
+
+import pytest
+from hdx.utilities.path import temp_dir
+from requests import ConnectionError, Session
+
+from instrumentation import RunReport
+
+
+class TestInstrumentation:
+    class Response:
+        def __init__(self, url, seconds, status_code=200):
+            self.url = url
+            self.elapsed = timedelta(seconds=seconds)
+            self.status_code = status_code
+
+    def test_run_report(self):
+        report = RunReport()
+        with report.stage('ingest'):
+            pass
+        report.add_request(self.Response('https://data.humdata.org/api/action/package_show', 0.5))
+        with report.country('AFG'):
+            with report.stage('country csv') as written:
+                written['bytes'] = 100
+            with report.stage('country csv') as written:
+                written['bytes'] = 50
+            report.add_request(self.Response('http://www.internal-displacement.org/countries/Afghanistan/', 0.25))
+            report.add_request(self.Response('http://www.internal-displacement.org/countries/Afghanistan/', 1.0, 404))
+        report.add_stage('create_in_hdx', 2.0)
+
+        assert report.stages['ingest']['calls'] == 1
+        assert report.stages['country csv']['calls'] == 2
+        assert report.stages['country csv']['bytes'] == 150
+        assert report.stages['create_in_hdx']['seconds'] == 2.0
+        assert report.hosts == {'data.humdata.org': {'requests': 1, 'seconds': 0.5, 'max_seconds': 0.5, 'errors': 0},
+                                'www.internal-displacement.org': {'requests': 2, 'seconds': 1.25, 'max_seconds': 1.0,
+                                                                  'errors': 1}}
+        country = report.countries['AFG']
+        assert list(country['stages']) == ['country csv']
+        assert country['stages']['country csv']['bytes'] == 150
+        assert country['hosts']['www.internal-displacement.org']['requests'] == 2
+
+        session = Session()
+        report.instrument_session(session)
+        report.instrument_session(session)
+        assert session.hooks['response'] == [report.add_request]
+        with pytest.raises(ConnectionError):
+            session.get('http://127.0.0.1:1/missing')
+        assert report.hosts['127.0.0.1:1']['requests'] == 1
+        assert report.hosts['127.0.0.1:1']['errors'] == 1
+        assert report.stages['ingest']['max_rss_growth_mb'] >= 0
+
+        with temp_dir('idmc-instrumentation') as folder:
+            path = join(folder, 'run_report.json')
+            summary = report.save(path)
+            with open(path) as f:
+                assert json.load(f) == summary
+        assert sorted(summary) == ['countries', 'hosts', 'peak_rss_mb', 'seconds', 'stages', 'started']
+
+        report.reset()
+        assert report.stages == dict()
+        assert report.countries == dict()
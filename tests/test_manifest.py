@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+Unit tests for publish manifest.
+
+'''
+from os.path import join
+
+import pytest
+from hdx.data.dataset import Dataset
+from hdx.data.resource import Resource
+from hdx.hdx_configuration import Configuration
+from hdx.utilities.path import temp_dir
+from hdx.utilities.saver import save_str_to_file
+
+from manifest import PublishManifest
+
+
+class TestPublishManifest:
+    @pytest.fixture(scope='function')
+    def configuration(self):
+        Configuration._create(hdx_read_only=True, user_agent='test',
+                              project_config_yaml=join('tests', 'config', 'project_configuration.yml'))
+
+    @staticmethod
+    def get_dataset(folder, contents):
+        dataset = Dataset({'name': 'idmc-idp-data-for-afghanistan', 'title': 'Afghanistan'})
+        for name, content in contents:
+            path = join(folder, '%s.csv' % name)
+            save_str_to_file(content, path)
+            resource = Resource({'name': name, 'description': name})
+            resource.set_file_type('csv')
+            resource.set_file_to_upload(path)
+            dataset.add_update_resource(resource)
+        return dataset
+
+    def test_manifest(self, configuration):
+        with temp_dir('idmc-manifest') as folder:
+            path = join(folder, 'manifest.json')
+            manifest = PublishManifest(path)
+            dataset = self.get_dataset(folder, [('displacement_data', 'a,b\n'), ('disaster_data', 'c,d\n')])
+            hashes = manifest.get_hashes(dataset)
+            assert manifest.is_unchanged(dataset, hashes) is False
+            assert manifest.skip_unchanged_resources(dataset, hashes) == 0
+            for resource in dataset.get_resources():
+                resource['url'] = 'http://lala/%s.csv' % resource['name']
+            manifest.record(dataset, hashes)
+
+            manifest = PublishManifest(path)
+            dataset = self.get_dataset(folder, [('displacement_data', 'a,b\n'), ('disaster_data', 'c,d\n')])
+            hashes = manifest.get_hashes(dataset)
+            assert manifest.is_unchanged(dataset, hashes) is True
+            dataset['title'] = 'Afghanistan - IDPs'
+            assert manifest.is_unchanged(dataset, manifest.get_hashes(dataset)) is False
+
+            dataset = self.get_dataset(folder, [('displacement_data', 'a,b\n'), ('disaster_data', 'e,f\n')])
+            hashes = manifest.get_hashes(dataset)
+            assert manifest.is_unchanged(dataset, hashes) is False
+            assert manifest.skip_unchanged_resources(dataset, hashes) == 1
+            displacement, disaster = dataset.get_resources()
+            assert displacement.get_file_to_upload() is None
+            assert displacement['url'] == 'http://lala/displacement_data.csv'
+            assert disaster.get_file_to_upload() == join(folder, 'disaster_data.csv')
+            displacement.check_required_fields(ignore_fields=['package_id'])
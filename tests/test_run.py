@@ -0,0 +1,155 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+Unit tests for building to a staging folder.
+
+'''
+import multiprocessing
+from contextlib import contextmanager
+from os import makedirs
+from os.path import exists, join
+
+import pytest
+from hdx.data.showcase import Showcase
+from hdx.data.vocabulary import Vocabulary
+from hdx.hdx_configuration import Configuration
+from hdx.hdx_locations import Locations
+from hdx.location.country import Country
+from hdx.utilities.downloader import DownloadError
+from hdx.utilities.loader import load_file_to_str
+from hdx.utilities.path import get_temp_dir, temp_dir
+
+import run
+from instrumentation import report
+from staging import save_manifest
+
+
+class TestRun:
+    @pytest.fixture(scope='function')
+    def configuration(self):
+        Configuration._create(hdx_read_only=True, user_agent='test',
+                              project_config_yaml=join('tests', 'config', 'project_configuration.yml'))
+        Locations.set_validlocations([{'name': 'afg', 'title': 'Afghanistan'}, {'name': 'tza', 'title': 'Tanzania'}, {'name': 'world', 'title': 'World'}])
+        Country.countriesdata(use_live=False)
+        Vocabulary._tags_dict = True
+        Vocabulary._approved_vocabulary = {'tags': [{'name': 'hxl'}, {'name': 'violence and conflict'}, {'name': 'displacement'}, {'name': 'internally displaced persons - idp'}], 'id': '4e61d464-4943-4e97-973a-84673c1aaa87', 'name': 'approved'}
+
+    @pytest.fixture(scope='function')
+    def cache(self):
+        class Cache:
+            @staticmethod
+            def download_tabular_key_value(url):
+                names = {'https://lala': 'Internally displaced persons - IDPs',
+                         'https://haha': 'Internally displaced persons - IDPs (new displacement associated with disasters)'}
+                return {'Indicator Name': names[url], 'Long definition': 'Description',
+                        'Statistical concept and methodology': 'Methodology', 'Limitations and exceptions': 'Caveats'}
+
+            @staticmethod
+            def download_file(url, folder, filename):
+                files = {'https://dada': 'idmc_displacement_all_dataset.xlsx',
+                         'https://wawa': 'idmc_disaster_all_dataset.xlsx'}
+                return join('tests', 'fixtures', files[url])
+
+            @staticmethod
+            def setup(url):
+                if 'Afghanistan' in url or url.endswith('/Tanzania/'):
+                    return True
+                raise DownloadError('Download Error!')
+
+            @staticmethod
+            def get_hashes():
+                return {'https://dada': 'abc'}
+
+        return Cache()
+
+    def build(self, monkeypatch, cache, folder, build_workers):
+        @contextmanager
+        def thread_downloaders():
+            yield lambda: cache
+
+        monkeypatch.setattr(run, 'thread_downloaders', thread_downloaders)
+        monkeypatch.setenv('TEMP_DIR', join(folder, 'temp'))
+        staging = join(folder, 'staging')
+        config = Configuration.read()
+        report.reset()
+        manifest = run.build(cache, staging, config['indicators'], config['tags'], dict(config, build_workers=build_workers))
+        summary = report.get_report()
+        return manifest, summary
+
+    def test_build(self, configuration, cache, monkeypatch):
+        with temp_dir('idmc-run') as folder:
+            manifest, summary = self.build(monkeypatch, cache, join(folder, '1'), 1)
+            assert [entry['iso3'] for entry in manifest['countries']] == ['AFG', 'TZA']
+            assert manifest['sources'] == {'https://dada': 'abc'}
+            # the indicator datasets get the quick charts of the resource view yml named in the configuration
+            assert [entry['resourceview']['title'] for entry in manifest['indicators']] == ['Quick Charts', 'Quick Charts']
+            assert 'Sum of New Displacements by Year' in manifest['indicators'][1]['resourceview']['hxl_preview_config']
+            assert summary['stages']['showcase url']['calls'] == 3
+            assert summary['stages']['country']['calls'] == 3
+            assert summary['countries']['AFG']['stages']['showcase url']['calls'] == 1
+
+            parallel_manifest, parallel_summary = self.build(monkeypatch, cache, join(folder, '2'), 2)
+            assert [entry['iso3'] for entry in parallel_manifest['countries']] == ['AFG', 'TZA']
+            for name, stage in summary['stages'].items():
+                assert parallel_summary['stages'][name]['calls'] == stage['calls']
+                assert parallel_summary['stages'][name]['bytes'] == stage['bytes']
+            for countryiso, country in summary['countries'].items():
+                for name, stage in country['stages'].items():
+                    assert parallel_summary['countries'][countryiso]['stages'][name]['calls'] == stage['calls']
+
+    def test_failed_build(self, configuration, cache, monkeypatch):
+        with temp_dir('idmc-run') as folder:
+            manifest, _ = self.build(monkeypatch, cache, folder, 1)
+            assert exists(join(folder, 'staging', 'manifest.json'))
+
+            def download_file(url, folder, filename):
+                raise DownloadError('Download Error!')
+
+            cache.download_file = download_file
+            with pytest.raises(DownloadError):
+                self.build(monkeypatch, cache, folder, 1)
+            assert not exists(join(folder, 'staging', 'manifest.json'))
+
+    def test_build_needs_fork(self, configuration, cache, monkeypatch):
+        monkeypatch.setattr(multiprocessing, 'get_start_method', lambda: 'spawn')
+        with temp_dir('idmc-run') as folder:
+            with pytest.raises(ValueError):
+                self.build(monkeypatch, cache, folder, 2)
+            assert not exists(join(folder, 'staging'))
+
+    def test_publish_resumes_from_failed_country(self, configuration, monkeypatch):
+        class Cache:
+            def __init__(self):
+                self.completed = list()
+
+            def mark_completed(self, sources):
+                self.completed.append(sources)
+
+        published = list()
+
+        def publish_staged_country_dataset(staging, entry, batch, manifest):
+            if entry['iso3'] == fail:
+                raise DownloadError('Upload Error!')
+            published.append(entry['iso3'])
+
+        monkeypatch.setattr(run, 'publish_staged_country_dataset', publish_staged_country_dataset)
+        monkeypatch.delenv('WHERETOSTART', raising=False)
+        with temp_dir('idmc-run') as folder:
+            monkeypatch.setenv('TEMP_DIR', join(folder, 'temp'))
+            staging = join(folder, 'staging')
+            makedirs(staging)
+            countries = [{'iso3': countryiso} for countryiso in ('AAA', 'BBB', 'CCC', 'DDD', 'EEE')]
+            save_manifest(staging, Showcase({'name': 'idmc-idp-data'}), list(), countries, {'https://dada': 'abc'})
+            cache = Cache()
+            fail = 'BBB'
+            with pytest.raises(DownloadError):
+                run.publish(cache, staging, 3)
+            # later countries were already handed out but the progress must not move past the failed one
+            assert load_file_to_str(join(get_temp_dir('IDMC'), 'progress.txt')) == 'iso3=BBB'
+            assert cache.completed == list()
+
+            published.clear()
+            fail = None
+            run.publish(cache, staging, 3)
+            assert published == ['BBB', 'CCC', 'DDD', 'EEE']
+            assert cache.completed == [{'https://dada': 'abc'}]
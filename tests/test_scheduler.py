@@ -0,0 +1,41 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+Unit tests for scheduler.
+
+'''
+import json
+from urllib.request import urlopen
+
+from scheduler import MetricsServer, Scheduler
+
+
+class TestScheduler:
+    def test_scheduler(self):
+        outcomes = [{'stages': {'ingest': {'calls': 2, 'seconds': 1.5}}}, None, ValueError('bad sheet')]
+
+        def poll():
+            outcome = outcomes.pop(0)
+            if not outcomes:
+                scheduler.stop()
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        scheduler = Scheduler(poll, interval_minutes=0)
+        metrics = scheduler.get_metrics()
+        assert metrics['polls'] == 0
+        assert metrics['report'] is None
+        scheduler.run_forever()
+        metrics = scheduler.get_metrics()
+        assert metrics['polls'] == 3
+        assert metrics['runs'] == 1
+        assert metrics['errors'] == 1
+        assert metrics['last_error'] == 'ValueError: bad sheet'
+        assert metrics['report'] == {'stages': {'ingest': {'calls': 2, 'seconds': 1.5}}}
+        assert metrics['last_run'] <= metrics['last_poll'] <= metrics['next_poll']
+
+        with MetricsServer(scheduler, 0) as server:
+            assert server.server.server_address[0] == '127.0.0.1'
+            with urlopen('http://127.0.0.1:%d/metrics' % server.port) as response:
+                assert json.loads(response.read().decode('utf-8')) == metrics
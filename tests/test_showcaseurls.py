@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+Unit tests for showcase urls.
+
+'''
+from os.path import join
+
+import pytest
+from hdx.location.country import Country
+from hdx.utilities.downloader import DownloadError
+from hdx.utilities.path import temp_dir
+from requests import HTTPError, Response
+
+from showcaseurls import ShowcaseURLs
+
+
+class TestShowcaseURLs:
+    @pytest.fixture(scope='function')
+    def downloader(self):
+        class Download:
+            urls = list()
+
+            def setup(self, url):
+                self.urls.append(url)
+                if 'Afghanistan' in url or url.endswith('/Tanzania/'):
+                    return True
+                if 'Burundi' in url:
+                    response = Response()
+                    response.status_code = 404
+                    raise DownloadError('Download Error!') from HTTPError(response=response)
+                raise DownloadError('Download Error!')
+
+        Country.countriesdata(use_live=False)
+        return Download()
+
+    def test_resolve(self, downloader):
+        with temp_dir('idmc-showcaseurls') as folder:
+            path = join(folder, 'showcase_urls.json')
+            showcase_urls = ShowcaseURLs(path)
+            urls = showcase_urls.resolve(['AFG', 'TZA', 'AB9'], lambda: downloader, workers=2)
+            assert urls == {'AFG': 'http://www.internal-displacement.org/countries/Afghanistan/',
+                            'TZA': 'http://www.internal-displacement.org/countries/Tanzania/', 'AB9': None}
+            assert len(downloader.urls) == 3
+
+            showcase_urls = ShowcaseURLs(path)
+            assert showcase_urls.resolve(['AFG', 'TZA', 'AB9'], lambda: downloader) == urls
+            assert len(downloader.urls) == 3
+            assert showcase_urls.get_expired(['AFG', 'SDN']) == ['SDN']
+
+            showcase_urls = ShowcaseURLs(path, ttl_days=-1)
+            assert showcase_urls.get_expired(['AFG', 'SDN']) == ['AFG', 'SDN']
+
+    def test_resolve_errors(self, downloader):
+        with temp_dir('idmc-showcaseurls') as folder:
+            path = join(folder, 'showcase_urls.json')
+            showcase_urls = ShowcaseURLs(path)
+            assert showcase_urls.resolve(['BDI', 'SDN'], lambda: downloader) == {'BDI': None, 'SDN': None}
+            assert len(downloader.urls) == 4
+            # only the 404 is remembered, the other failure is probed again
+            showcase_urls = ShowcaseURLs(path)
+            assert showcase_urls.get_expired(['BDI', 'SDN']) == ['SDN']
+            assert showcase_urls.resolve(['BDI', 'SDN'], lambda: downloader) == {'BDI': None, 'SDN': None}
+            assert len(downloader.urls) == 6
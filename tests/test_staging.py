@@ -0,0 +1,61 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+Unit tests for staging.
+
+'''
+from os.path import join
+
+import pytest
+from hdx.data.dataset import Dataset
+from hdx.data.showcase import Showcase
+from hdx.hdx_configuration import Configuration
+from hdx.hdx_locations import Locations
+from hdx.location.country import Country
+from hdx.utilities.path import temp_dir
+
+from manifest import PublishManifest
+from staging import get_staged_sources, load_manifest, load_staged_dataset, save_manifest, stage_dataset
+
+
+class TestStaging:
+    @pytest.fixture(scope='function')
+    def configuration(self):
+        Configuration._create(hdx_read_only=True, user_agent='test',
+                              project_config_yaml=join('tests', 'config', 'project_configuration.yml'))
+        Locations.set_validlocations([{'name': 'afg', 'title': 'Afghanistan'}])
+        Country.countriesdata(use_live=False)
+
+    def test_staging(self, configuration):
+        with temp_dir('idmc-staging') as staging:
+            dataset = Dataset({'name': 'idmc-idp-data-for-afghanistan', 'title': 'Afghanistan - IDPs'})
+            dataset.add_country_location('AFG')
+            rows = [['ISO3', 'Year', 'Conflict Stock Displacement'], ['#country+code', '#date+year', '#affected+idps+ind+stock+conflict'],
+                    ['AFG', 2018, 2598000]]
+            dataset.generate_resource_from_rows(staging, 'displacement_data_Afghanistan.csv', rows,
+                                                {'name': 'displacement_data', 'description': 'IDPs for Afghanistan'})
+            dataset.generate_resource_from_rows(staging, 'disaster_data_Afghanistan.csv', rows,
+                                                {'name': 'disaster_data', 'description': 'Disaster IDPs for Afghanistan'})
+            resourceview = dataset.generate_resource_view(path=join('config', 'hdx_resource_view_static.yml'),
+                                                          bites_disabled=[False, True, True])
+            entry = stage_dataset(staging, dataset, resourceview, ['displacement_data', 'disaster_data'], iso3='AFG')
+            assert entry['iso3'] == 'AFG'
+            assert [resource['file'] for resource in entry['resources']] == ['displacement_data_Afghanistan.csv',
+                                                                             'disaster_data_Afghanistan.csv']
+
+            showcase = Showcase({'name': 'idmc-global-report-on-internal-displacement'})
+            assert get_staged_sources(staging) is None
+            save_manifest(staging, showcase, list(), [entry], {'https://dada': 'abc'})
+            staged = load_manifest(staging)
+            assert staged['sources'] == {'https://dada': 'abc'}
+            assert get_staged_sources(staging) == {'https://dada': 'abc'}
+            assert staged['showcase'] == showcase.data
+
+            loaded, loaded_resourceview = load_staged_dataset(staging, staged['countries'][0])
+            assert loaded.data == dataset.data
+            assert loaded.get_resources() == dataset.get_resources()
+            assert [resource.get_file_to_upload() for resource in loaded.get_resources()] == \
+                   [resource.get_file_to_upload() for resource in dataset.get_resources()]
+            assert loaded.preview_resourceview.data == resourceview.data
+            assert PublishManifest.get_hashes(loaded, loaded_resourceview) == \
+                PublishManifest.get_hashes(dataset, resourceview)
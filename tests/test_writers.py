@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+Unit tests for writers.
+
+'''
+import gzip
+import json
+import zipfile
+from os.path import join
+
+import pytest
+from hdx.data.dataset import Dataset
+from hdx.hdx_configuration import Configuration
+from hdx.utilities.path import temp_dir
+
+from idmc import IndicatorData
+from writers import get_parquet_values, write_resource
+
+
+class TestWriters:
+    headers = ['ISO3', 'Year', 'Conflict Stock Displacement']
+    hxltags = ['#country+code', '#date+year', '#affected+idps+ind+stock+conflict']
+
+    @pytest.fixture(scope='function')
+    def indicatordata(self):
+        Configuration._create(hdx_read_only=True, user_agent='test',
+                              project_config_yaml=join('tests', 'config', 'project_configuration.yml'))
+        indicatordata = IndicatorData(self.headers, self.hxltags)
+        indicatordata.add_row('AFG', ['AFG', 2017, 10])
+        indicatordata.add_row('TZA', ['TZA', 2017, None])
+        indicatordata.add_row('AFG', ['AFG', 2018, 'a, "b"'])
+        return indicatordata
+
+    def write(self, folder, writer, indicatordata, countryiso=None):
+        dataset = Dataset()
+        resource = write_resource(dataset, writer, folder, 'displacement_data_%s' % writer, self.headers, self.hxltags,
+                                  indicatordata, {'name': 'displacement_data', 'description': 'IDPs'}, countryiso)
+        assert dataset.get_resources() == [resource]
+        return resource
+
+    def test_writers(self, indicatordata):
+        with temp_dir('idmc-writers') as folder:
+            csv = self.write(folder, 'csv', indicatordata)
+            assert csv['format'] == 'csv'
+            with open(csv.get_file_to_upload(), 'rb') as f:
+                expected = f.read()
+            assert expected == b'ISO3,Year,Conflict Stock Displacement\r\n#country+code,#date+year,#affected+idps+ind+stock+conflict\r\n' \
+                               b'AFG,2017,10\r\nTZA,2017,\r\nAFG,2018,"a, ""b"""\r\n'
+
+            resource = self.write(folder, 'gzip', indicatordata)
+            assert resource['format'] == 'gz'
+            path = resource.get_file_to_upload()
+            assert path.endswith('displacement_data_gzip.csv.gz')
+            with gzip.open(path) as f:
+                assert f.read() == expected
+            with open(path, 'rb') as f:
+                first = f.read()
+            self.write(folder, 'gzip', indicatordata)
+            with open(path, 'rb') as f:
+                assert f.read() == first
+
+            resource = self.write(folder, 'bundle', indicatordata)
+            assert resource['format'] == 'zip'
+            with zipfile.ZipFile(resource.get_file_to_upload()) as bundle:
+                assert bundle.namelist() == ['AFG.csv', 'TZA.csv']
+                assert bundle.read('TZA.csv') == b'ISO3,Year,Conflict Stock Displacement\r\n#country+code,#date+year,#affected+idps+ind+stock+conflict\r\n' \
+                                                 b'TZA,2017,\r\n'
+            resource = self.write(folder, 'bundle', indicatordata, 'AFG')
+            with zipfile.ZipFile(resource.get_file_to_upload()) as bundle:
+                assert bundle.namelist() == ['AFG.csv']
+
+            with pytest.raises(ValueError):
+                self.write(folder, 'xls', indicatordata)
+
+    def test_parquet_values(self):
+        assert get_parquet_values([2017, None, 2018]) == [2017, None, 2018]
+        assert get_parquet_values([True, None, 3]) == [1, None, 3]
+        values = get_parquet_values([10, None, 2.5, False])
+        assert values == [10.0, None, 2.5, 0.0]
+        assert all(isinstance(value, float) for value in values if value is not None)
+        assert get_parquet_values([10, 'a, "b"', 2.5]) == ['10', 'a, "b"', '2.5']
+
+    def test_parquet(self, indicatordata):
+        parquet = pytest.importorskip('pyarrow.parquet')
+        with temp_dir('idmc-writers') as folder:
+            resource = self.write(folder, 'parquet', indicatordata, 'AFG')
+            assert resource['format'] == 'parquet'
+            table = parquet.read_table(resource.get_file_to_upload())
+            assert table.column_names == self.headers
+            assert table.to_pydict()['ISO3'] == ['AFG', 'AFG']
+            assert table.to_pydict()['Conflict Stock Displacement'] == ['10', 'a, "b"']
+            assert json.loads(table.schema.metadata[b'hxltags'].decode('utf-8')) == self.hxltags
+
+            indicatordata = IndicatorData(self.headers, self.hxltags)
+            indicatordata.add_row('AFG', ['AFG', 2017, 10])
+            indicatordata.add_row('AFG', ['AFG', 2018, 2.5])
+            table = parquet.read_table(self.write(folder, 'parquet', indicatordata).get_file_to_upload())
+            assert str(table.schema.field('Conflict Stock Displacement').type) == 'double'
+            assert table.to_pydict()['Conflict Stock Displacement'] == [10.0, 2.5]
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Writers:
+------------
+
+Writes the rows of an indicator, or of one country of an indicator, to a resource file as plain csv, gzipped csv, a
+zip with a csv per country or Parquet. Rows are streamed from the column store rather than gathered into a list.
+
+"""
+import csv
+import gzip
+import io
+import json
+import zipfile
+from itertools import chain
+from os.path import join
+
+from hdx.data.resource import Resource
+
+# Fixed so that unchanged rows give identical files which the publish manifest will not upload again
+timestamp = (1980, 1, 1, 0, 0, 0)
+
+
+def write_csv_rows(f, headers, hxltags, rows):
+    writer = csv.writer(f)
+    writer.writerow(headers)
+    writer.writerow(hxltags)
+    writer.writerows(rows)
+
+
+def write_gzip(path, headers, hxltags, indicatordata, countryiso=None):
+    with open(path, 'wb') as f:
+        with gzip.GzipFile(filename='', mode='wb', fileobj=f, mtime=0) as gz:
+            with io.TextIOWrapper(gz, encoding='utf-8', newline='') as text:
+                write_csv_rows(text, headers, hxltags, indicatordata.get_rows(countryiso))
+
+
+def write_bundle(path, headers, hxltags, indicatordata, countryiso=None):
+    if countryiso is None:
+        countryisos = sorted(indicatordata.countryrows, key=str)
+    else:
+        countryisos = [countryiso]
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as bundle:
+        for iso3 in countryisos:
+            info = zipfile.ZipInfo('%s.csv' % iso3, date_time=timestamp)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with bundle.open(info, 'w') as f:
+                with io.TextIOWrapper(f, encoding='utf-8', newline='') as text:
+                    write_csv_rows(text, headers, hxltags, indicatordata.get_rows(iso3))
+
+
+def get_parquet_values(values):
+    """Returns the values of a column in a form pyarrow can give one type: a mix of booleans and integers as integers,
+    of numbers including floats as floats and any other mix of types as strings"""
+    types = {type(value) for value in values if value is not None}
+    if len(types) < 2:
+        return values
+    if types <= {bool, int}:
+        convert = int
+    elif types <= {bool, int, float}:
+        convert = float
+    else:
+        convert = str
+    return [None if value is None else convert(value) for value in values]
+
+
+def write_parquet(path, headers, hxltags, indicatordata, countryiso=None):
+    """Writes a Parquet file with a column per header keeping the HXL hashtags in its metadata. Needs pyarrow."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError('pyarrow must be installed to write Parquet resources') from e
+    rownos = indicatordata.get_rownos(countryiso)
+    arrays = list()
+    for column in indicatordata.columns:
+        arrays.append(pyarrow.array(get_parquet_values([column[rowno] for rowno in rownos])))
+    table = pyarrow.Table.from_arrays(arrays, names=headers)
+    table = table.replace_schema_metadata({'hxltags': json.dumps(hxltags)})
+    pyarrow.parquet.write_table(table, path)
+
+
+# writer: (file extension, resource file type, function writing rows to a path)
+writers = {
+    'gzip': ('csv.gz', 'gz', write_gzip),
+    'bundle': ('zip', 'zip', write_bundle),
+    'parquet': ('parquet', 'parquet', write_parquet)
+}
+
+
+def write_resource(dataset, writer, folder, name, headers, hxltags, indicatordata, resourcedata, countryiso=None):
+    """Writes the rows of indicatordata, only those of countryiso if given, to a file in folder named name plus the
+    extension of writer and adds it to dataset as a resource. writer is csv (the default), gzip, bundle or parquet."""
+    if writer == 'csv':
+        # a callable returning an iterator is streamed to the csv rather than building a list of all rows
+        rows = lambda: chain([headers, hxltags], indicatordata.get_rows(countryiso))
+        return dataset.generate_resource_from_rows(folder, '%s.csv' % name, rows, resourcedata)
+    if writer not in writers:
+        raise ValueError('Unknown writer %s! Use csv, %s.' % (writer, ', '.join(sorted(writers))))
+    extension, file_type, write = writers[writer]
+    path = join(folder, '%s.%s' % (name, extension))
+    write(path, headers, hxltags, indicatordata, countryiso)
+    resource = Resource(resourcedata)
+    resource.set_file_type(file_type)
+    resource.set_file_to_upload(path)
+    dataset.add_update_resource(resource)
+    return resource